@@ -4,100 +4,227 @@ Determines if a call is a serious emergency requiring human dispatch
 or a general inquiry that can be handled by AI voice agent.
 """
 
+import asyncio
 import os
-from typing import Dict, Any
-from langchain_groq import ChatGroq
-from langchain_core.prompts import ChatPromptTemplate
-from dotenv import load_dotenv
+import re
+from dataclasses import dataclass
+from typing import Dict, Any, List, Optional
+import orjson
+from groq import AsyncGroq
 
-load_dotenv()
+from groq_inference.cache import cached
+from groq_inference.client import GROQ_CALL_TIMEOUT, client, request_slots
+from groq_inference.criticality import CRITICALITY_LEVELS, get_criticality_level
+from groq_inference.prefilter import quick_criticality
+from groq_inference.router import pick_model, reasoning_options
+from groq_inference.summarize import SUMMARY_TRANSCRIPT_TOKENS, get_call_summary
+from groq_inference.transcripts import clip_transcript
+
+EMERGENCY_KEYWORDS = [
+    "emergency", "urgent", "help", "911", "ambulance", "police", "fire",
+    "heart attack", "stroke", "bleeding", "unconscious", "not breathing",
+    "robbery", "assault", "violence", "threat", "danger",
+    "explosion", "accident", "injury", "hospital", "critical"
+]
+
+# All keywords in one pattern so the transcript is scanned in a single pass.
+# The lookahead reports overlapping matches, like a substring check per keyword.
+_INDICATOR_RE = re.compile(
+    "(?=(" + "|".join(re.escape(k) for k in sorted(EMERGENCY_KEYWORDS, key=len, reverse=True)) + "))"
+)
+
+CLASSIFIER_MAX_TOKENS = 256
+CLASSIFIER_TRANSCRIPT_TOKENS = 256
+# The combined triage reply also carries a 2-3 sentence summary
+TRIAGE_CALL_MAX_TOKENS = 512
+# Severities routed to a human dispatcher; everything lower goes to the voice agent
+EMERGENCY_SEVERITIES = frozenset({"CRITICAL", "HIGH"})
+# Budget for triage_call as a whole, fallback included. Twilio gives up on a
+# webhook after 15 seconds, so this leaves room to answer with the fallback.
+TRIAGE_TIMEOUT = float(os.getenv("TRIAGE_TIMEOUT", "10"))
+
+TRIAGE_CALL_PROMPT = """
+You are an emergency dispatch triage assistant for 911 operations during high-call-volume incidents.
+
+For each call you must decide:
+
+1. severity: CRITICAL, HIGH, MEDIUM, or LOW
+
+CRITICAL - Confirmed immediate threat to life (people trapped in fire, not breathing,
+           building collapse with victims, imminent explosion, multiple casualties)
+HIGH - Urgent and potentially life-threatening (spreading fire near homes, serious
+       injuries with bleeding, downed power lines near people)
+MEDIUM - Distressing but no confirmed immediate danger (smoke without fire,
+         welfare checks, trapped but safe, unconfirmed hazards)
+LOW - Minor issues or information requests (evacuation centers, supplies,
+      property damage without danger)
+
+2. summary: a concise 2-3 sentence summary for dispatchers covering the nature of the
+   emergency or request, key details (location, injuries, hazards), and any immediate
+   action needed
+
+Respond with ONLY a JSON object in this form:
+{"severity": "CRITICAL", "summary": "..."}
+"""
+
+# System messages are module constants so every request sends byte-identical
+# prefixes (Groq reuses cached prompt prefixes); only the user turn varies.
+_TRIAGE_CALL_SYSTEM = {"role": "system", "content": TRIAGE_CALL_PROMPT}
+
+# Frozen: cached results are shared between calls
+@dataclass(frozen=True)
+class TriageResult:
+    """Routing, severity and dispatcher summary for one call"""
+    is_emergency: bool
+    severity: str
+    summary: str
 
 class EmergencyClassifier:
-    def __init__(self):
-        self.llm = ChatGroq(
-            temperature=0,
-            model_name="openai/gpt-oss-20b",
-            groq_api_key=os.getenv("GROQ_API_KEY")
-        )
-        
-        # System prompt for emergency classification
-        self.classification_prompt = ChatPromptTemplate.from_messages([
-            ("system", """You are an emergency dispatch classifier for 911 operations during high-call-volume incidents.
-            
-            Your job is to classify incoming calls into two categories:
-            1. EMERGENCY: Life-threatening situations requiring immediate human dispatch
-            2. NON_EMERGENCY: General inquiries, information requests, or non-critical situations
-
-            EMERGENCY indicators include:
-            - Life-threatening situations (heart attack, stroke, severe injury)
-            - Active crimes in progress (robbery, assault, domestic violence)
-            - Fires, explosions, or hazardous material incidents
-            - Medical emergencies requiring immediate attention
-            - Threats to safety or security
-            - Requests for police, fire, or ambulance with urgency
-
-            NON_EMERGENCY indicators include:
-            - General information requests
-            - Non-urgent medical questions
-            - Status updates or inquiries
-            - Administrative questions
-            - Non-critical complaints
-            - General safety questions
-
-            Respond with ONLY one word: "EMERGENCY" or "NON_EMERGENCY"
-            """),
-            ("human", "Caller says: {transcript}")
-        ])
-        
-        self.classification_chain = self.classification_prompt | self.llm
-
-    async def classify_call(self, transcript: str) -> Dict[str, Any]:
+    def __init__(self, groq_client: Optional[AsyncGroq] = None):
+        """
+        Args:
+            groq_client: Groq client to send requests with; defaults to the
+                shared pooled client so connections are reused across calls
+        """
+        self.client = groq_client or client
+
+    async def _complete(
+        self,
+        system_message: Dict[str, str],
+        transcript: str,
+        model: Optional[str] = None,
+        transcript_tokens: int = CLASSIFIER_TRANSCRIPT_TOKENS,
+        max_tokens: int = CLASSIFIER_MAX_TOKENS,
+        **options: Any,
+    ) -> str:
+        """
+        Send a transcript to Groq under the given system message
+
+        Args:
+            system_message: Prebuilt system message for the task
+            transcript: The transcribed speech from the caller
+            model: Groq model to use; picked from the transcript by default
+            transcript_tokens: Approximate token budget for the transcript
+            max_tokens: Completion token cap, reasoning included
+            **options: Extra chat completion parameters (e.g. response_format)
+
+        Returns:
+            The model's reply, or an empty string if it returned no content
+        """
+        model = model or pick_model(transcript)
+        async with asyncio.timeout(GROQ_CALL_TIMEOUT), request_slots:
+            chat_completion = await self.client.chat.completions.create(
+                messages=[
+                    system_message,
+                    {"role": "user", "content": f"Caller says: {clip_transcript(transcript, transcript_tokens)}"}
+                ],
+                model=model,
+                temperature=0,
+                **reasoning_options(model),
+                max_completion_tokens=max_tokens,
+                **options,
+            )
+        return chat_completion.choices[0].message.content or ""
+
+    @cached(cache_if=lambda result: result is not None)
+    async def _triage_json(self, transcript: str, model: Optional[str] = None) -> Optional[TriageResult]:
+        """
+        Ask for severity and summary in one JSON-mode completion
+
+        Returns:
+            The parsed result, or None if the call failed or the reply didn't parse
         """
-        Classify a call transcript as emergency or non-emergency
-        
+        try:
+            response = await self._complete(
+                _TRIAGE_CALL_SYSTEM,
+                transcript,
+                model,
+                transcript_tokens=SUMMARY_TRANSCRIPT_TOKENS,
+                max_tokens=TRIAGE_CALL_MAX_TOKENS,
+                response_format={"type": "json_object"},
+            )
+            parsed = orjson.loads(response)
+            severity = str(parsed["severity"]).upper()
+            summary = parsed["summary"]
+            if severity not in CRITICALITY_LEVELS or not isinstance(summary, str) or not summary:
+                return None
+            return TriageResult(
+                is_emergency=severity in EMERGENCY_SEVERITIES,
+                severity=severity,
+                summary=summary.strip(),
+            )
+        except Exception:
+            return None
+
+    async def triage_call(self, transcript: str, model: Optional[str] = None) -> TriageResult:
+        """
+        Rate a call's severity and summarize it with a single Groq call
+
+        The call is routed from its severity: CRITICAL and HIGH go to a human
+        dispatcher, so no separate emergency classification is needed. A call
+        the keyword prefilter rates CRITICAL only asks Groq for its summary.
+        Otherwise this falls back to the separate summary and criticality
+        helpers, run concurrently, if the combined reply can't be used. Both
+        stages share TRIAGE_TIMEOUT; a call that runs out of time is treated
+        as HIGH, or CRITICAL if the prefilter already said so.
+
         Args:
             transcript: The transcribed speech from the caller
-            
+            model: Groq model to use; picked from the transcript by default
+
         Returns:
-            Dict containing classification result and confidence
+            TriageResult for the call
         """
+        quick_level = quick_criticality(transcript)
+        summary, severity = transcript, quick_level or "HIGH"
         try:
-            # Get classification from LLM
-            response = await self.classification_chain.ainvoke({"transcript": transcript})
-            classification = response.content.strip().upper()
-            
-            # Determine if it's an emergency
-            is_emergency = classification == "EMERGENCY"
-            
-            return {
-                "is_emergency": is_emergency,
-                "classification": classification,
-                "transcript": transcript,
-                "confidence": "high" if classification in ["EMERGENCY", "NON_EMERGENCY"] else "low"
-            }
-            
-        except Exception as e:
-            # Default to emergency if classification fails (safety first)
-            return {
-                "is_emergency": True,
-                "classification": "EMERGENCY",
-                "transcript": transcript,
-                "confidence": "low",
-                "error": str(e)
-            }
+            async with asyncio.timeout(TRIAGE_TIMEOUT):
+                if quick_level is not None:
+                    # Severity is settled locally; only the dispatcher summary needs Groq
+                    summary = await get_call_summary(transcript, model, groq_client=self.client)
+                else:
+                    result = await self._triage_json(transcript, model)
+                    if result is not None:
+                        return result
+
+                    summary, severity = await asyncio.gather(
+                        get_call_summary(transcript, model, groq_client=self.client),
+                        get_criticality_level(transcript, model, groq_client=self.client),
+                        return_exceptions=True
+                    )
+        except Exception:
+            # Out of time, or the prefiltered call's summary failed; the
+            # fallbacks below fill in whatever is missing
+            pass
+        # Same safety-first fallbacks as each helper: HIGH (an emergency), transcript
+        severity = severity if severity in CRITICALITY_LEVELS else "HIGH"
+        return TriageResult(
+            is_emergency=severity in EMERGENCY_SEVERITIES,
+            severity=severity,
+            summary=summary if isinstance(summary, str) and not summary.startswith("ERROR") else transcript,
+        )
+
+    async def triage_batch(self, transcripts: List[str], model: Optional[str] = None) -> List[TriageResult]:
+        """
+        Triage several call transcripts concurrently
+
+        Every Groq request still waits for one of the shared request_slots, so a
+        large batch queues there instead of running into rate limits.
+
+        Args:
+            transcripts: The transcribed speech from each caller
+            model: Groq model to use; picked per transcript by default
+
+        Returns:
+            TriageResult per transcript, in the same order
+        """
+        return list(await asyncio.gather(
+            *(self.triage_call(transcript, model) for transcript in transcripts)
+        ))
 
     def get_emergency_indicators(self, transcript: str) -> list:
         """
         Extract potential emergency indicators from transcript
         """
-        emergency_keywords = [
-            "emergency", "urgent", "help", "911", "ambulance", "police", "fire",
-            "heart attack", "stroke", "bleeding", "unconscious", "not breathing",
-            "robbery", "assault", "violence", "threat", "danger", "fire",
-            "explosion", "accident", "injury", "hospital", "critical"
-        ]
-        
-        transcript_lower = transcript.lower()
-        found_indicators = [keyword for keyword in emergency_keywords if keyword in transcript_lower]
-        
-        return found_indicators
+        found = {match.group(1) for match in _INDICATOR_RE.finditer(transcript.lower())}
+        return [keyword for keyword in EMERGENCY_KEYWORDS if keyword in found]
@@ -1,4 +1,4 @@
-from .criticality import get_criticality_level
-from .summarize import get_call_summary
+from .criticality import get_criticality_level, get_criticality_levels
+from .summarize import collect, get_call_summary, stream_call_summary
 
-__all__ = ['get_criticality_level', 'get_call_summary']
+__all__ = ['get_criticality_level', 'get_criticality_levels', 'get_call_summary', 'stream_call_summary', 'collect']
@@ -0,0 +1,206 @@
+"""
+In-memory response cache for the Groq helpers
+Repeat and near-repeat transcripts (retries, test runs, callers reporting the
+same incident) are answered from memory instead of a new Groq round-trip.
+Identical requests that arrive while the first is still in flight share its
+result rather than each calling Groq.
+"""
+
+import asyncio
+import copy
+import hashlib
+import itertools
+import re
+import time
+import weakref
+from collections import OrderedDict
+from functools import wraps
+from typing import Any, Awaitable, Callable, Optional
+
+_NON_WORD_RE = re.compile(r"[^\w\s]+")
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def _normalize(text: str) -> str:
+    """Collapse case, punctuation and whitespace differences between transcripts"""
+    return _WHITESPACE_RE.sub(" ", _NON_WORD_RE.sub(" ", text.lower())).strip()
+
+
+def _digest(*parts: str) -> bytes:
+    return hashlib.blake2b("\x00".join(parts).encode("utf-8"), digest_size=16).digest()
+
+
+class ResponseCache:
+    """
+    LRU cache with a per-entry TTL
+
+    Each response is stored under two keys: the exact transcript and its
+    normalized form, so a near-identical transcript still hits.
+    """
+
+    def __init__(self, maxsize: int = 10_000, ttl: float = 3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: OrderedDict[bytes, tuple[float, Any]] = OrderedDict()
+
+    def _get(self, key: bytes) -> tuple[bool, Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return False, None
+
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return False, None
+
+        self._entries.move_to_end(key)
+        return True, value
+
+    def _set(self, key: bytes, value: Any):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def get(self, namespace: str, text: str) -> tuple[bool, Any]:
+        """
+        Look up a cached response
+
+        Args:
+            namespace: Identifies the helper (and therefore the prompt) being cached
+            text: The transcript sent to the helper
+
+        Returns:
+            Tuple of (hit, value)
+        """
+        hit, value = self._get(_digest(namespace, text))
+        if hit:
+            return hit, value
+        return self._get(_digest(namespace, "~", _normalize(text)))
+
+    def set(self, namespace: str, text: str, value: Any):
+        """
+        Store a response under both the exact and the normalized transcript
+
+        Args:
+            namespace: Identifies the helper (and therefore the prompt) being cached
+            text: The transcript sent to the helper
+            value: The response to cache
+        """
+        self._set(_digest(namespace, text), value)
+        self._set(_digest(namespace, "~", _normalize(text)), value)
+
+    def clear(self):
+        self._entries.clear()
+
+
+# Stable per-object tokens for non-string arguments such as a method's self.
+# Unlike id(), a token is never reused by a later object.
+_object_tokens: "weakref.WeakKeyDictionary[Any, int]" = weakref.WeakKeyDictionary()
+_token_counter = itertools.count()
+
+
+def _arg_key(arg: Any) -> str:
+    """Cache key fragment for an argument the transcript text doesn't cover"""
+    if arg is None or isinstance(arg, (str, int, float, bool)):
+        return repr(arg)
+    try:
+        token = _object_tokens.get(arg)
+        if token is None:
+            token = _object_tokens[arg] = next(_token_counter)
+        return f"<{type(arg).__qualname__} #{token}>"
+    except TypeError:  # unhashable, or doesn't support weak references
+        return f"<{type(arg).__qualname__} @{id(arg)}>"
+
+
+def _share(value: Any) -> Any:
+    """Hand each caller its own copy of a mutable container"""
+    if isinstance(value, (dict, list, set)):
+        return copy.copy(value)
+    return value
+
+
+class _Abandoned(Exception):
+    """Set on an in-flight call whose owner was cancelled before it finished"""
+
+
+def cached(
+    ttl: float = 3600,
+    maxsize: int = 10_000,
+    cache_if: Optional[Callable[[Any], bool]] = None,
+):
+    """
+    Cache the result of an async helper keyed on all of its arguments
+
+    Positional strings (the transcript) are also matched in normalized form;
+    every other argument, including a method's self, must match exactly.
+    Callers get their own copy of dict, list and set results.
+
+    Concurrent calls with the same arguments are coalesced: only the first
+    runs the helper, the rest await its result. If the first is cancelled,
+    one of the rest runs the helper in its place.
+
+    Args:
+        ttl: Seconds a cached response stays valid
+        maxsize: Maximum number of entries before the least recently used is evicted
+        cache_if: Optional predicate; results for which it returns False
+            (e.g. error fallbacks) are not cached
+
+    Returns:
+        Decorator for an async function
+    """
+    def decorator(func: Callable[..., Awaitable[Any]]):
+        cache = ResponseCache(maxsize=maxsize, ttl=ttl)
+        namespace = f"{func.__module__}.{func.__qualname__}"
+        inflight: dict[bytes, asyncio.Future] = {}
+
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            text = "\x00".join(a for a in args if isinstance(a, str))
+            scope = "\x00".join(
+                [namespace]
+                + [f"{i}:{_arg_key(a)}" for i, a in enumerate(args) if not isinstance(a, str)]
+                + [f"{k}={_arg_key(v)}" for k, v in sorted(kwargs.items())]
+            )
+
+            hit, value = cache.get(scope, text)
+            if hit:
+                return _share(value)
+
+            key = _digest(scope, text)
+            # Waiters whose owner was cancelled loop round, and one of them
+            # becomes the new owner
+            while (pending := inflight.get(key)) is not None:
+                try:
+                    return _share(await asyncio.shield(pending))
+                except _Abandoned:
+                    continue
+
+            future = asyncio.get_running_loop().create_future()
+            inflight[key] = future
+            try:
+                value = await func(*args, **kwargs)
+            except asyncio.CancelledError:
+                # Only the owner was cancelled; the waiters retry instead
+                future.set_exception(_Abandoned())
+                future.exception()
+                raise
+            except Exception as e:
+                future.set_exception(e)
+                # Mark the exception retrieved in case nobody else was waiting
+                future.exception()
+                raise
+            else:
+                future.set_result(value)
+            finally:
+                inflight.pop(key, None)
+
+            if cache_if is None or cache_if(value):
+                cache.set(scope, text, value)
+            return _share(value)
+
+        wrapper.cache = cache
+        wrapper.inflight = inflight
+        return wrapper
+
+    return decorator
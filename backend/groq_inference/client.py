@@ -0,0 +1,42 @@
+"""
+Shared Groq client for all inference helpers
+One HTTP/2 connection pool is reused by every module so calls don't pay a
+fresh TCP + TLS handshake.
+"""
+
+import asyncio
+import os
+
+import httpx
+from groq import AsyncGroq, DefaultAsyncHttpxClient
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# The SDK retries connection errors, timeouts, 429s and 5xx responses itself,
+# with exponential backoff and jitter between attempts
+GROQ_MAX_RETRIES = 3
+
+# Wall-clock budget for one helper call, across all of its retries. Two of
+# these back to back (triage and its fallback) must fit Twilio's 15s webhook
+GROQ_CALL_TIMEOUT = float(os.getenv("GROQ_CALL_TIMEOUT", "5"))
+
+# Requests in flight at once, sized to the account's rate limits; bursts wait
+# here for a slot instead of drawing 429s and backing off. Time spent waiting
+# counts against GROQ_CALL_TIMEOUT.
+GROQ_MAX_CONCURRENCY = int(os.getenv("GROQ_MAX_CONCURRENCY", "16"))
+request_slots = asyncio.Semaphore(GROQ_MAX_CONCURRENCY)
+
+# Idle connections are kept for five minutes so calls between bursts still skip
+# the handshake; a dead route fails fast on connect instead of using the full budget
+http_client = DefaultAsyncHttpxClient(
+    http2=True,
+    limits=httpx.Limits(max_connections=100, max_keepalive_connections=100, keepalive_expiry=300),
+    timeout=httpx.Timeout(30.0, connect=5.0),
+)
+
+client = AsyncGroq(http_client=http_client, max_retries=GROQ_MAX_RETRIES)
+
+async def aclose():
+    """Close the shared Groq client and its connection pool"""
+    await client.close()
@@ -1,74 +1,188 @@
+import asyncio
+import re
+from typing import Optional
+
+import orjson
 from groq import AsyncGroq
-from dotenv import load_dotenv
 
-load_dotenv()
+from .cache import cached
+from .client import GROQ_CALL_TIMEOUT, client, request_slots
+from .prefilter import quick_criticality
+from .router import DEFAULT_MODEL, is_reasoning_model, pick_model, reasoning_options
+from .transcripts import clip_transcript
 
-client = AsyncGroq()
+CRITICALITY_LEVELS = ("CRITICAL", "MEDIUM", "HIGH", "LOW")
+# Whole-word match so "LOW" isn't found inside words like "BELOW"
+_CRIT_RE = re.compile(r"\b(" + "|".join(CRITICALITY_LEVELS) + r")\b", re.IGNORECASE)
+CRITICALITY_MAX_TOKENS = 256
+# Models that answer directly only ever need room for the one-word label
+CRITICALITY_LABEL_TOKENS = 3
+# Criticality is decided from the opening of the call; the rest only adds prefill
+CRITICALITY_TRANSCRIPT_TOKENS = 256
+# Completion room per call in a batch, for the label and its JSON punctuation
+BATCH_TOKENS_PER_CALL = 8
 
 SYSTEM_PROMPT = """
-You are a 911 switch operator receiving calls immediately after a large-scale disaster event. Resources are severely limited and you must prioritize which calls need immediate response versus those that can wait.
+Classify a 911 call made after a large-scale disaster by severity. Respond with exactly one word:
+CRITICAL - confirmed threat to life (trapped by fire or rubble, not breathing, unconscious, severe bleeding, imminent explosion, hazardous material exposure, multiple casualties)
+HIGH - urgent, likely threat to life (fire spreading toward homes, serious injury, live power lines near people)
+MEDIUM - distress but no confirmed danger (smoke without fire, missing neighbor, trapped but safe)
+LOW - information request or minor issue (shelters, supplies, property damage)
+If danger to life is confirmed, escalate; if uncertain between two levels, choose the lower. Output one word only.
+"""
 
-Your ONLY task is to assess the criticality level of each call and respond with EXACTLY ONE WORD: LOW, MEDIUM, HIGH, or CRITICAL
+# One worked example per level, paraphrased so they don't mirror the test cases
+FEW_SHOT_EXAMPLES = (
+    ("The apartment next door collapsed and there are people under it, I can hear them yelling", "CRITICAL"),
+    ("A tree fell on my husband's leg, it's cut open and bleeding a lot", "HIGH"),
+    ("There's a burning smell in the hallway but I don't see any flames", "MEDIUM"),
+    ("Which shelters are still taking people tonight?", "LOW"),
+)
 
-Classification criteria:
+# Prebuilt so every request sends a byte-identical prefix Groq can cache
+_SYSTEM_MESSAGE = {"role": "system", "content": SYSTEM_PROMPT}
+_FEW_SHOT_MESSAGES = [
+    message
+    for transcript, level in FEW_SHOT_EXAMPLES
+    for message in (
+        {"role": "user", "content": transcript},
+        {"role": "assistant", "content": level},
+    )
+]
 
-CRITICAL - Immediate life-threatening emergency requiring instant response:
-  • Confirmed active fire with people trapped
-  • Building collapse with victims underneath
-  • People not breathing, unconscious, or severe bleeding
-  • Imminent explosions or hazardous material exposure
-  • Multiple casualties confirmed
+# Overrides the one-word output rule when several calls are sent together
+_BATCH_SYSTEM_MESSAGE = {
+    "role": "system",
+    "content": "When you are given several numbered calls at once, return a JSON array "
+               "with one level per call, in the same order, e.g. [\"HIGH\", \"LOW\"]. "
+               "Output ONLY the array, nothing else.",
+}
+_BATCH_INSTRUCTIONS = "Classify each of the following calls. Return a JSON array of labels in order.\n"
+_ARRAY_RE = re.compile(r"\[.*?\]", re.DOTALL)
 
-HIGH - Urgent and potentially life-threatening, needs rapid attention:
-  • Spreading fires approaching occupied structures
-  • Serious injuries with active bleeding
-  • Downed power lines near people
-  • Structural damage with potential collapse risk
+# Only real labels are cached; an unparseable reply would otherwise stick for the TTL
+@cached(cache_if=lambda content: content in CRITICALITY_LEVELS)
+async def get_criticality_level(
+    call_transcript: str, model: Optional[str] = None, groq_client: Optional[AsyncGroq] = None
+) -> str:
+    """
+    Assess the criticality level of a 911 call transcript.
 
-MEDIUM - Distressing situation but no immediate confirmed danger:
-  • Smell of smoke without visible fire
-  • Welfare checks on missing neighbors
-  • People trapped but currently safe
-  • Uncertain threats or unconfirmed hazards
+    Args:
+        call_transcript: The text of the emergency call
+        model: Groq model to use; picked from the transcript by default
+        groq_client: Groq client to send the request with; defaults to the
+            shared pooled client
 
-LOW - Minor issues, information requests, can wait:
-  • Questions about evacuation centers or safe zones
-  • General safety inquiries without specific threat
-  • Property damage without immediate danger
-  • Resource location requests (water, supplies)
+    Returns:
+        The criticality level: LOW, MEDIUM, HIGH, or CRITICAL
+    """
+    quick_level = quick_criticality(call_transcript)
+    if quick_level is not None:
+        return quick_level
 
-When in doubt between two levels, consider: Is there confirmed immediate danger to life? If yes, escalate. If uncertain, choose the lower level.
+    model = model or pick_model(call_transcript)
 
-Output ONLY the classification level, nothing else.
-"""
+    # Stop reading as soon as a level has been emitted; nothing after it is used
+    content = ""
+    async with asyncio.timeout(GROQ_CALL_TIMEOUT), request_slots:
+        stream = await (groq_client or client).chat.completions.create(
+            messages=[
+                _SYSTEM_MESSAGE,
+                *_FEW_SHOT_MESSAGES,
+                {
+                    "role": "user",
+                    "content": clip_transcript(call_transcript, CRITICALITY_TRANSCRIPT_TOKENS),
+                }
+            ],
+            model=model,
+            temperature=0,
+            top_p=1,
+            # gpt-oss reasons before answering, so the cap must leave room for a
+            # short chain of thought on top of the one-word label
+            **reasoning_options(model),
+            max_completion_tokens=CRITICALITY_MAX_TOKENS if is_reasoning_model(model) else CRITICALITY_LABEL_TOKENS,
+            stream=True,
+        )
+
+        try:
+            async for chunk in stream:
+                if not chunk.choices:
+                    continue
+                content += chunk.choices[0].delta.content or ""
+                match = _CRIT_RE.search(content)
+                if match:
+                    return match.group(1).upper()
+        finally:
+            await stream.close()
 
-async def get_criticality_level(call_transcript: str) -> str:
+    if not content:
+        return "ERROR: No content returned"
+    return content.strip()
+
+async def get_criticality_levels(
+    call_transcripts: list[str], model: Optional[str] = None, groq_client: Optional[AsyncGroq] = None
+) -> list[str]:
     """
-    Assess the criticality level of a 911 call transcript.
+    Assess the criticality level of several 911 call transcripts in one request.
+
+    The system prompt is prefilled once for the whole batch instead of once per
+    call. If the reply can't be matched up with the transcripts, each unresolved
+    call is assessed on its own instead.
 
     Args:
-        call_transcript: The text of the emergency call
+        call_transcripts: The texts of the emergency calls
+        model: Groq model to use; defaults to the full model because one model
+            has to serve the whole batch
+        groq_client: Groq client to send the request with; defaults to the
+            shared pooled client
 
     Returns:
-        The criticality level: LOW, MEDIUM, HIGH, or CRITICAL
+        One criticality level per transcript, in the same order
     """
-    chat_completion = await client.chat.completions.create(
-        messages=[
-            {
-                "role": "system",
-                "content": SYSTEM_PROMPT
-            },
-            {
-                "role": "user",
-                "content": call_transcript,
-            }
-        ],
-        model="openai/gpt-oss-20b",
-        temperature=0.5,
-        top_p=1,
-        stream=False,
+    levels = [quick_criticality(transcript) for transcript in call_transcripts]
+    pending = [i for i, level in enumerate(levels) if level is None]
+    if not pending:
+        return levels
+
+    model = model or DEFAULT_MODEL
+    numbered = "\n".join(
+        f"{n}. {clip_transcript(call_transcripts[i], CRITICALITY_TRANSCRIPT_TOKENS)}"
+        for n, i in enumerate(pending, 1)
     )
-    content = chat_completion.choices[0].message.content
-    if content is None:
-        return "ERROR: No content returned"
-    return content.strip()
+
+    labels = []
+    try:
+        async with asyncio.timeout(GROQ_CALL_TIMEOUT), request_slots:
+            response = await (groq_client or client).chat.completions.create(
+                messages=[
+                    _SYSTEM_MESSAGE,
+                    *_FEW_SHOT_MESSAGES,
+                    _BATCH_SYSTEM_MESSAGE,
+                    {"role": "user", "content": _BATCH_INSTRUCTIONS + numbered},
+                ],
+                model=model,
+                temperature=0,
+                top_p=1,
+                **reasoning_options(model),
+                max_completion_tokens=(CRITICALITY_MAX_TOKENS if is_reasoning_model(model) else 0)
+                                      + BATCH_TOKENS_PER_CALL * len(pending),
+            )
+        match = _ARRAY_RE.search(response.choices[0].message.content or "")
+        if match:
+            labels = [_CRIT_RE.search(str(label)) for label in orjson.loads(match.group(0))]
+    except Exception:
+        # Timeouts, API errors and malformed arrays all take the per-call path
+        labels = []
+
+    if len(labels) == len(pending) and all(labels):
+        for i, label in zip(pending, labels):
+            levels[i] = label.group(1).upper()
+        return levels
+
+    # The batch reply was unusable, so fall back to one request per call
+    for i, level in zip(pending, await asyncio.gather(
+        *(get_criticality_level(call_transcripts[i], model, groq_client=groq_client) for i in pending)
+    )):
+        levels[i] = level
+    return levels
@@ -0,0 +1,91 @@
+"""
+Deterministic keyword pre-filter for call triage
+Transcripts that name an immediate threat to life are resolved locally as
+CRITICAL; everything else, including negated or past mentions ("he's not
+unconscious anymore", "had a heart attack last year"), falls through to Groq. Nothing is ever resolved
+as LOW here: a keyword list can't rule an emergency out.
+"""
+
+import re
+from typing import Optional
+
+def _phrases(*phrases: str) -> re.Pattern:
+    return re.compile(r"\b(?:" + "|".join(re.escape(p) for p in phrases) + r")", re.IGNORECASE)
+
+def _words(*words: str) -> re.Pattern:
+    return re.compile(r"\b(?:" + "|".join(re.escape(w) for w in words) + r")\b", re.IGNORECASE)
+
+# Phrases that mean an immediate threat to life, unless negated or in the past
+_CRITICAL_RE = _phrases(
+    "not breathing", "isn't breathing", "stopped breathing", "no pulse",
+    "heart attack", "unconscious",
+)
+
+# Checked in the few words either side of a critical phrase, within its clause
+GUARD_WORDS = 3
+_CLAUSE_BREAK_RE = re.compile(r"[.,;:!?]")
+_NEGATION_RE = _words(
+    "not", "no", "never", "no longer", "isn't", "wasn't", "aren't", "weren't",
+    "don't", "doesn't", "didn't", "without",
+)
+_PAST_BEFORE_RE = _words("had", "was", "history of", "used to", "previous", "previously")
+_PAST_AFTER_RE = _words(
+    "ago", "before", "anymore", "any more", "last year", "last month", "last week",
+    "in the past",
+)
+
+def _is_current(transcript: str, match: re.Match) -> bool:
+    """Whether a critical phrase describes what's happening now"""
+    before = _CLAUSE_BREAK_RE.split(transcript[:match.start()])[-1]
+    after = _CLAUSE_BREAK_RE.split(transcript[match.end():])[0]
+    lead = " ".join(before.split()[-GUARD_WORDS:])
+    tail = " ".join(after.split()[:GUARD_WORDS])
+    return not (
+        _NEGATION_RE.search(lead)
+        or _PAST_BEFORE_RE.search(lead)
+        or _PAST_AFTER_RE.search(tail)
+    )
+
+# Any hazard, injury, medical complaint or call for help; used to keep such
+# calls on the full model. Kept broad: a miss sends an emergency to the small model.
+_HAZARD_RE = _phrases(
+    "emergency", "urgent", "help", "911", "ambulance", "police", "fire", "smoke",
+    "burn", "gas", "explo", "collapse", "trapped", "stuck", "injur", "hurt",
+    "bleed", "blood", "breath", "unconscious", "heart", "stroke", "fell", "fall",
+    "accident", "crash", "gun", "shot", "knife", "robb", "assault", "attack",
+    "violen", "threat", "danger", "drown", "dying", "dead", "missing", "power line",
+    "hospital", "critical", "bleeding", "injury", "robbery", "explosion",
+    # Medical emergencies that name none of the above
+    "seizure", "convuls", "overdose", "overdosed", "pills", "poison", "choking",
+    "choke", "labor", "contraction", "pregnan", "water broke", "not responding",
+    "unresponsive", "won't wake", "can't wake", "passed out", "pass out", "faint",
+    "collapsed", "allerg", "swelling", "diabet", "insulin", "chest pain", "suicid",
+    "kill", "abuse", "kidnap", "lost child", "can't find",
+)
+
+def quick_criticality(transcript: str) -> Optional[str]:
+    """
+    Resolve a transcript as CRITICAL without an LLM call when possible.
+
+    Args:
+        transcript: The text of the emergency call
+
+    Returns:
+        "CRITICAL" when the wording names an immediate threat to life, otherwise None
+    """
+    for match in _CRITICAL_RE.finditer(transcript):
+        if _is_current(transcript, match):
+            return "CRITICAL"
+    return None
+
+def mentions_hazard(transcript: str) -> bool:
+    """
+    Check whether a transcript mentions any hazard, injury or call for help.
+
+    Args:
+        transcript: The text of the emergency call
+
+    Returns:
+        True if any hazard vocabulary appears in the transcript
+    """
+    return _HAZARD_RE.search(transcript) is not None
@@ -0,0 +1,55 @@
+"""
+Model routing for the Groq helpers
+When GROQ_MODEL_ROUTING is on, calls that mention no hazard at all go to a
+small, fast model; anything that might be dangerous goes to the larger
+reasoning model.
+"""
+
+import os
+from typing import Any, Dict
+
+from .prefilter import mentions_hazard
+
+DEFAULT_MODEL = "openai/gpt-oss-20b"
+FAST_MODEL = "llama-3.1-8b-instant"
+
+# Off by default: FAST_MODEL's criticality accuracy hasn't been measured with
+# test_criticality.py yet, so every call gets DEFAULT_MODEL until it has
+ROUTING_ENABLED = os.getenv("GROQ_MODEL_ROUTING", "false").lower() == "true"
+
+# Longer transcripts tend to be mixed or ambiguous, so they always get DEFAULT_MODEL
+FAST_MODEL_MAX_WORDS = 40
+
+def pick_model(transcript: str) -> str:
+    """
+    Choose the cheapest model that can handle a transcript.
+
+    Args:
+        transcript: The text of the emergency call
+
+    Returns:
+        The Groq model name to use
+    """
+    if not ROUTING_ENABLED:
+        return DEFAULT_MODEL
+    if len(transcript.split()) <= FAST_MODEL_MAX_WORDS and not mentions_hazard(transcript):
+        return FAST_MODEL
+    return DEFAULT_MODEL
+
+def is_reasoning_model(model: str) -> bool:
+    """Whether a model thinks before answering (and so needs token headroom)"""
+    return model.startswith("openai/gpt-oss")
+
+def reasoning_options(model: str) -> Dict[str, Any]:
+    """
+    Reasoning parameters for a model; only the gpt-oss models accept them.
+
+    Args:
+        model: The Groq model name
+
+    Returns:
+        Keyword arguments to pass to chat.completions.create
+    """
+    if is_reasoning_model(model):
+        return {"reasoning_effort": "low", "include_reasoning": False}
+    return {}
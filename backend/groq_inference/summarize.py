@@ -1,10 +1,14 @@
-from groq import AsyncGroq
-from dotenv import load_dotenv
 import asyncio
+from typing import AsyncIterator, Optional
+
+from groq import AsyncGroq
 
-load_dotenv()
+from .cache import cached
+from .client import GROQ_CALL_TIMEOUT, client, request_slots
+from .router import pick_model
+from .transcripts import clip_transcript
 
-client = AsyncGroq()
+SUMMARY_TRANSCRIPT_TOKENS = 1024
 
 SUMMARY_PROMPT = """
 You are a 911 dispatch assistant summarizing emergency calls for quick review by operators.
@@ -17,38 +21,86 @@ Your task is to create a concise 2-3 sentence summary of the call transcript tha
 Be clear, factual, and concise. Focus on information that helps dispatchers quickly understand the situation.
 """
 
-async def get_call_summary(call_transcript: str) -> str:
+# Prebuilt so every request sends a byte-identical prefix Groq can cache
+_SYSTEM_MESSAGE = {"role": "system", "content": SUMMARY_PROMPT}
+
+async def stream_call_summary(
+    call_transcript: str, model: Optional[str] = None, groq_client: Optional[AsyncGroq] = None
+) -> AsyncIterator[str]:
+    """
+    Stream a 2-3 sentence summary of a 911 call transcript as it is generated.
+
+    Args:
+        call_transcript: The text of the emergency call
+        model: Groq model to use; picked from the transcript by default
+        groq_client: Groq client to send the request with; defaults to the
+            shared pooled client
+
+    Yields:
+        Summary text fragments in the order they are generated
+    """
+    # The slot is held until the stream is closed, since the request is in flight until then
+    async with request_slots:
+        stream = await (groq_client or client).chat.completions.create(
+            messages=[
+                _SYSTEM_MESSAGE,
+                {
+                    "role": "user",
+                    "content": clip_transcript(call_transcript, SUMMARY_TRANSCRIPT_TOKENS),
+                }
+            ],
+            model=model or pick_model(call_transcript),
+            temperature=0.5,
+            top_p=1,
+            stream=True,
+        )
+        try:
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        finally:
+            await stream.close()
+
+async def collect(fragments: AsyncIterator[str]) -> str:
+    """
+    Join a stream of text fragments into a single string.
+
+    Args:
+        fragments: Async iterator of text fragments
+
+    Returns:
+        The concatenated text
+    """
+    return "".join([fragment async for fragment in fragments])
+
+@cached(cache_if=lambda content: not content.startswith("ERROR"))
+async def get_call_summary(
+    call_transcript: str, model: Optional[str] = None, groq_client: Optional[AsyncGroq] = None
+) -> str:
     """
     Generate a 2-3 sentence summary of a 911 call transcript.
 
     Args:
         call_transcript: The text of the emergency call
+        model: Groq model to use; picked from the transcript by default
+        groq_client: Groq client to send the request with; defaults to the
+            shared pooled client
 
     Returns:
         A concise 2-3 sentence summary of the call
     """
-    chat_completion = await client.chat.completions.create(
-        messages=[
-            {
-                "role": "system",
-                "content": SUMMARY_PROMPT
-            },
-            {
-                "role": "user",
-                "content": call_transcript,
-            }
-        ],
-        model="openai/gpt-oss-20b",
-        temperature=0.5,
-        top_p=1,
-        stream=False,
-    )
-    content = chat_completion.choices[0].message.content
-    if content is None:
+    async with asyncio.timeout(GROQ_CALL_TIMEOUT):
+        content = await collect(stream_call_summary(call_transcript, model, groq_client))
+    if not content:
         return "ERROR: No content returned"
     return content.strip()
 
 if __name__ == "__main__":
+    try:
+        import uvloop
+    except ImportError:  # uvloop doesn't support Windows
+        uvloop = None
+
     # Sample usage
     sample_transcripts = [
         "My house is on fire and my family is trapped inside! We're on the second floor and the stairs are blocked. Please hurry, there's smoke everywhere!",
@@ -69,4 +121,4 @@ if __name__ == "__main__":
             print(f"Summary: {summary}")
             print("-" * 60)
 
-    asyncio.run(demo())
+    asyncio.run(demo(), loop_factory=uvloop.new_event_loop if uvloop else None)
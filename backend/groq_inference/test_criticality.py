@@ -6,13 +6,24 @@ import sys
 from datetime import datetime
 from pathlib import Path
 
+try:
+    import uvloop
+except ImportError:  # uvloop doesn't support Windows
+    uvloop = None
+
 # Add parent directory to path for imports
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
-from groq_inference.criticality import get_criticality_level
+from groq_inference.criticality import get_criticality_level, get_criticality_levels
+
+# Results are written to CSV files in the temp folder
+TEMP_DIR = "temp"
+os.makedirs(TEMP_DIR, exist_ok=True)
+# Large enough that every row stays buffered until the file is closed
+CSV_BUFFER_SIZE = 128 * 1024
 
 # Local test suite for criticality analysis
-async def run_tests():
+async def run_tests(batch: bool = False):
     test_cases = [
         # CRITICAL cases - immediate life-threatening emergencies
         {
@@ -98,128 +109,147 @@ async def run_tests():
         }
     ]
 
-    print("Running 911 Call Triage Test Suite (Concurrent)")
-    print("=" * 60)
-    print(f"Running {len(test_cases)} tests in parallel...\n")
+    if batch:
+        print("Running 911 Call Triage Test Suite (Batched)")
+        print("=" * 60)
+        print(f"Running {len(test_cases)} tests in a single request...\n")
+    else:
+        print("Running 911 Call Triage Test Suite (Concurrent)")
+        print("=" * 60)
+        print(f"Running {len(test_cases)} tests in parallel...\n")
+
+    # Helper function to build the record for one test
+    def test_result(test, test_number, result, elapsed_time):
+        test_passed = test['expected'] in result.upper()
+
+        return {
+            'test_number': test_number,
+            'description': test['description'],
+            'message': test['message'],
+            'expected': test['expected'],
+            'actual': result,
+            'passed': 'PASS' if test_passed else 'FAIL',
+            'response_time': elapsed_time
+        }
+
+    def error_result(test, test_number, e):
+        return {
+            'test_number': test_number,
+            'description': test['description'],
+            'message': test['message'],
+            'expected': test['expected'],
+            'actual': f'ERROR: {e}',
+            'passed': 'ERROR',
+            'response_time': None
+        }
 
     # Helper function to run a single test with timing
     async def run_single_test(test, test_number):
         try:
             start_time = time.time()
             result = await get_criticality_level(test['message'])
-            elapsed_time = time.time() - start_time
-
-            test_passed = test['expected'] in result.upper()
-
-            return {
-                'test_number': test_number,
-                'description': test['description'],
-                'message': test['message'],
-                'expected': test['expected'],
-                'actual': result,
-                'passed': 'PASS' if test_passed else 'FAIL',
-                'response_time': elapsed_time
-            }
+            return test_result(test, test_number, result, time.time() - start_time)
         except Exception as e:
-            return {
-                'test_number': test_number,
-                'description': test['description'],
-                'message': test['message'],
-                'expected': test['expected'],
-                'actual': f'ERROR: {e}',
-                'passed': 'ERROR',
-                'response_time': None
-            }
-
-    # Run all tests concurrently
-    overall_start = time.time()
-    test_results = await asyncio.gather(*[
-        run_single_test(test, i)
-        for i, test in enumerate(test_cases, 1)
-    ])
-    overall_elapsed = time.time() - overall_start
+            return error_result(test, test_number, e)
+
+    # Yield each test's record as soon as it is available
+    async def completed_results():
+        if not batch:
+            for next_result in asyncio.as_completed([
+                run_single_test(test, i)
+                for i, test in enumerate(test_cases, 1)
+            ]):
+                yield await next_result
+            return
+
+        # One request covers every test, so each is credited an equal share of it
+        try:
+            start_time = time.time()
+            results = await get_criticality_levels([t['message'] for t in test_cases])
+            amortized_time = (time.time() - start_time) / len(test_cases)
+        except Exception as e:
+            for i, test in enumerate(test_cases, 1):
+                yield error_result(test, i, e)
+            return
+
+        for i, (test, result) in enumerate(zip(test_cases, results), 1):
+            yield test_result(test, i, result, amortized_time)
 
-    # Process and display results
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    csv_filename = os.path.join(TEMP_DIR, f"test_results_{timestamp}.csv")
+    failures_filename = os.path.join(TEMP_DIR, f"test_failures_{timestamp}.csv")
+    fieldnames = ['test_number', 'passed', 'description', 'message', 'expected', 'actual', 'response_time']
+
+    # Build the report in memory and write it once instead of a print per line
+    lines = []
     passed = 0
     failed = 0
     response_times = []
 
-    for result in test_results:
-        print(f"\nTest {result['test_number']}/{len(test_cases)}: {result['description']}")
-        print(f"Message: \"{result['message']}\"")
-        print(f"Expected: {result['expected']}")
-        print(f"Got: {result['actual']}")
-
-        if result['response_time'] is not None:
-            print(f"Response time: {result['response_time']:.3f}s")
-            response_times.append(result['response_time'])
-        else:
-            print(f"Response time: N/A")
-
-        if result['passed'] == 'PASS':
-            print("✓ PASSED")
-            passed += 1
-        elif result['passed'] == 'ERROR':
-            print("✗ ERROR")
-            failed += 1
-        else:
-            print("✗ FAILED")
-            failed += 1
-
-    # Convert response_time to string for CSV output
-    for result in test_results:
-        if result['response_time'] is not None:
-            result['response_time'] = f"{result['response_time']:.3f}"
-        else:
-            result['response_time'] = 'N/A'
-
-    print("\n" + "=" * 60)
-    print(f"Results: {passed} passed, {failed} failed out of {len(test_cases)} tests")
-    print(f"Success rate: {(passed/len(test_cases)*100):.1f}%")
-
-    if response_times:
-        avg_time = sum(response_times) / len(response_times)
-        min_time = min(response_times)
-        max_time = max(response_times)
-        print(f"\nTiming Statistics:")
-        print(f"  Overall wall time: {overall_elapsed:.3f}s")
-        print(f"  Sum of all response times: {sum(response_times):.3f}s")
-        print(f"  Average response time: {avg_time:.3f}s")
-        print(f"  Minimum response time: {min_time:.3f}s")
-        print(f"  Maximum response time: {max_time:.3f}s")
-
-    # Write results to CSV file in temp folder
-    temp_dir = "temp"
-    os.makedirs(temp_dir, exist_ok=True)
-
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    csv_filename = os.path.join(temp_dir, f"test_results_{timestamp}.csv")
-
-    with open(csv_filename, 'w', newline='', encoding='utf-8') as csvfile:
-        fieldnames = ['test_number', 'passed', 'description', 'message', 'expected', 'actual', 'response_time']
+    # Run all tests, recording each one as soon as it finishes
+    overall_start = time.time()
+    # Failures are written alongside the full results in the same pass
+    with open(csv_filename, 'w', newline='', encoding='utf-8', buffering=CSV_BUFFER_SIZE) as csvfile, \
+            open(failures_filename, 'w', newline='', encoding='utf-8', buffering=CSV_BUFFER_SIZE) as failures_file:
         writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-
         writer.writeheader()
-        for result in test_results:
+        failures_writer = csv.DictWriter(failures_file, fieldnames=fieldnames)
+        failures_writer.writeheader()
+
+        async for result in completed_results():
+            lines.append(f"\nTest {result['test_number']}/{len(test_cases)}: {result['description']}")
+            lines.append(f"Message: \"{result['message']}\"")
+            lines.append(f"Expected: {result['expected']}")
+            lines.append(f"Got: {result['actual']}")
+
+            # Convert response_time to string for display and CSV output
+            if result['response_time'] is not None:
+                response_times.append(result['response_time'])
+                result['response_time'] = f"{result['response_time']:.3f}"
+                lines.append(f"Response time: {result['response_time']}s")
+            else:
+                result['response_time'] = 'N/A'
+                lines.append("Response time: N/A")
+
+            if result['passed'] == 'PASS':
+                lines.append("✓ PASSED")
+                passed += 1
+            elif result['passed'] == 'ERROR':
+                lines.append("✗ ERROR")
+                failed += 1
+            else:
+                lines.append("✗ FAILED")
+                failed += 1
+
             writer.writerow(result)
+            if result['passed'] != 'PASS':
+                failures_writer.writerow(result)
+    overall_elapsed = time.time() - overall_start
 
-    print(f"\n✓ Test results saved to: {csv_filename}")
+    lines.append("\n" + "=" * 60)
+    lines.append(f"Results: {passed} passed, {failed} failed out of {len(test_cases)} tests")
+    lines.append(f"Success rate: {(passed/len(test_cases)*100):.1f}%")
 
-    # Also create a filtered CSV with just the failures
-    failures = [r for r in test_results if r['passed'] != 'PASS']
-    if failures:
-        failures_filename = os.path.join(temp_dir, f"test_failures_{timestamp}.csv")
-        with open(failures_filename, 'w', newline='', encoding='utf-8') as csvfile:
-            fieldnames = ['test_number', 'passed', 'description', 'message', 'expected', 'actual', 'response_time']
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+    if response_times:
+        avg_time = sum(response_times) / len(response_times)
+        min_time = min(response_times)
+        max_time = max(response_times)
+        lines.append(f"\nTiming Statistics:")
+        lines.append(f"  Overall wall time: {overall_elapsed:.3f}s")
+        lines.append(f"  Sum of all response times: {sum(response_times):.3f}s")
+        lines.append(f"  Average response time: {avg_time:.3f}s" + (" (amortized)" if batch else ""))
+        lines.append(f"  Minimum response time: {min_time:.3f}s")
+        lines.append(f"  Maximum response time: {max_time:.3f}s")
 
-            writer.writeheader()
-            for result in failures:
-                writer.writerow(result)
+    lines.append(f"\n✓ Test results saved to: {csv_filename}")
+    sys.stdout.write("\n".join(lines) + "\n")
 
+    if failed:
         print(f"✓ Failed tests saved to: {failures_filename}")
     else:
+        os.remove(failures_filename)
         print("✓ All tests passed - no failures file created")
 
 if __name__ == "__main__":
-    asyncio.run(run_tests())
+    # Pass --batch to classify every test case in a single request
+    asyncio.run(run_tests(batch="--batch" in sys.argv), loop_factory=uvloop.new_event_loop if uvloop else None)
@@ -0,0 +1,25 @@
+"""
+Transcript preprocessing shared by the Groq helpers
+"""
+
+# Rough characters-per-token ratio for English text with the gpt-oss tokenizer
+CHARS_PER_TOKEN = 4
+
+def clip_transcript(transcript: str, max_tokens: int) -> str:
+    """
+    Cap a transcript at an approximate token budget before sending it to Groq.
+
+    Args:
+        transcript: The text of the emergency call
+        max_tokens: Approximate number of tokens to keep from the start
+
+    Returns:
+        The transcript, cut at a word boundary if it exceeds the budget
+    """
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    if len(transcript) <= max_chars:
+        return transcript
+
+    clipped = transcript[:max_chars]
+    cut = clipped.rfind(" ")
+    return clipped[:cut] if cut > 0 else clipped
@@ -1,17 +1,148 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
 from supabase import create_client, Client
 from pydantic import BaseModel
+from contextlib import asynccontextmanager
+from typing import Optional
 import datetime
-import json
 import asyncio
+import asyncpg
+import orjson
 import os
+import time
 from dotenv import load_dotenv
 
 load_dotenv()
 
-app = FastAPI()
+SUPABASE_URL = os.getenv("SUPABASE_URL")
+SUPABASE_KEY = os.getenv("SUPABASE_KEY")
+
+# Direct (session mode) Postgres connection string; LISTEN does not work through
+# the transaction pooler. When unset, everything goes through the Supabase client
+# and the stream falls back to polling.
+PG_DSN = os.getenv("PG_DSN")
+# Set to 0 if PG_DSN points at the transaction pooler, which can't keep
+# prepared statements across transactions
+PG_STATEMENT_CACHE_SIZE = int(os.getenv("PG_STATEMENT_CACHE_SIZE", "100"))
+# Pooled connections per worker process; every worker also holds one LISTEN
+# connection, so the total is up to WEB_CONCURRENCY * (PG_POOL_MAX_SIZE + 1)
+PG_POOL_MIN_SIZE = int(os.getenv("PG_POOL_MIN_SIZE", "1"))
+PG_POOL_MAX_SIZE = int(os.getenv("PG_POOL_MAX_SIZE", "5"))
+
+# Channel the callers insert trigger notifies (see sql/callers_notify.sql)
+CALLERS_CHANNEL = "callers_insert"
+HEARTBEAT_INTERVAL = 30
+
+# Polling fallback: the interval grows by POLL_BACKOFF on every empty poll up to
+# POLL_MAX seconds, and snaps back to POLL_MIN as soon as new callers show up
+POLL_MIN = float(os.getenv("POLL_MIN", "1.0"))
+POLL_MAX = float(os.getenv("POLL_MAX", "30.0"))
+POLL_BACKOFF = float(os.getenv("POLL_BACKOFF", "1.5"))
+
+# Only the columns the frontend reads
+CALLER_COLUMNS = "id, latitude, longitude, severity, metadata, created_at"
+# Most new callers sent per poll; a larger burst is picked up on the following polls
+DELTA_LIMIT = 100
+
+# Seconds a callers snapshot is shared between requests before it is re-queried
+SNAPSHOT_TTL = 2.0
+
+supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+
+# Latest callers snapshot per row limit: (fetched_at, rows, encoded rows)
+_snapshot_cache: dict[Optional[int], tuple[float, list, bytes]] = {}
+_snapshot_lock = asyncio.Lock()
+# Bumped whenever new callers arrive, so a query that overlapped them isn't cached.
+# server.py inserts callers too, so this process mostly learns of new rows
+# through LISTEN or polling rather than its own inserts.
+_snapshot_generation = 0
+
+# One queue per connected SSE client, fed by the shared LISTEN connection.
+# A client that falls SUBSCRIBER_BACKLOG callers behind is dropped; it
+# reconnects and starts again from a fresh snapshot.
+SUBSCRIBER_BACKLOG = 256
+_subscribers: set[asyncio.Queue] = set()
+
+# Longest wait between attempts to re-open a lost LISTEN connection
+RELISTEN_MAX_DELAY = 30
+
+def _drop_subscriber(queue: asyncio.Queue):
+    """Stop feeding a client and tell its stream to end"""
+    _subscribers.discard(queue)
+    while not queue.empty():
+        queue.get_nowait()
+    queue.put_nowait(None)
+
+async def _on_callers_insert(connection, pid, channel, payload):
+    # The notification only carries the id; NOTIFY payloads are capped at
+    # 8000 bytes and a long summary would make the trigger abort the insert
+    row = await app.state.pg.fetchrow(f"SELECT {CALLER_COLUMNS} FROM callers WHERE id = $1", int(payload))
+    if row is None:
+        return
+    caller = dict(row)
+    _invalidate_snapshots()
+    for queue in list(_subscribers):
+        try:
+            queue.put_nowait(caller)
+        except asyncio.QueueFull:
+            _drop_subscriber(queue)
+
+async def _listen() -> asyncpg.Connection:
+    """Open the shared LISTEN connection"""
+    listener = await asyncpg.connect(PG_DSN)
+    await listener.add_listener(CALLERS_CHANNEL, _on_callers_insert)
+    listener.add_termination_listener(_on_listener_lost)
+    return listener
+
+def _on_listener_lost(connection):
+    # Inserts made while disconnected are never notified, so every stream is
+    # ended and its client reconnects from a fresh snapshot. Streams opened
+    # before LISTEN is back poll instead.
+    app.state.listener = None
+    _invalidate_snapshots()
+    for queue in list(_subscribers):
+        _drop_subscriber(queue)
+    app.state.relisten = asyncio.create_task(_relisten())
+
+async def _relisten():
+    delay = 1
+    while True:
+        try:
+            app.state.listener = await _listen()
+            _invalidate_snapshots()
+            return
+        except Exception:
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, RELISTEN_MAX_DELAY)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Open the Postgres pool and the shared LISTEN connection for the lifetime of the app"""
+    app.state.pg = None
+    app.state.listener = None
+    app.state.relisten = None
+    if PG_DSN:
+        app.state.pg = await asyncpg.create_pool(
+            dsn=PG_DSN,
+            min_size=PG_POOL_MIN_SIZE,
+            max_size=PG_POOL_MAX_SIZE,
+            max_inactive_connection_lifetime=300,
+            command_timeout=60,
+            statement_cache_size=PG_STATEMENT_CACHE_SIZE,
+        )
+        app.state.listener = await _listen()
+    yield
+    if app.state.relisten is not None:
+        app.state.relisten.cancel()
+    if app.state.listener is not None:
+        # A deliberate close isn't a lost connection
+        app.state.listener.remove_termination_listener(_on_listener_lost)
+        await app.state.listener.close()
+    if app.state.pg is not None:
+        await app.state.pg.close()
+
+app = FastAPI(default_response_class=ORJSONResponse, lifespan=lifespan)
 
 # Add CORS middleware
 app.add_middleware(
@@ -22,10 +153,58 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_KEY")
+def sse(event: dict) -> bytes:
+    """Encode an event as a Server-Sent Events data frame"""
+    return b"data: " + orjson.dumps(event, default=str) + b"\n\n"
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+async def _query_callers(limit: Optional[int]) -> list:
+    if app.state.pg is not None:
+        if limit is None:
+            rows = await app.state.pg.fetch(f"SELECT {CALLER_COLUMNS} FROM callers ORDER BY created_at DESC")
+        else:
+            rows = await app.state.pg.fetch(f"SELECT {CALLER_COLUMNS} FROM callers ORDER BY created_at DESC LIMIT $1", limit)
+        return [dict(row) for row in rows]
+
+    query = supabase.table("callers").select(CALLER_COLUMNS).order("created_at", desc=True)
+    if limit is not None:
+        query = query.limit(limit)
+    # supabase-py is synchronous; keep its HTTP round-trip off the event loop
+    return (await asyncio.to_thread(query.execute)).data
+
+def _invalidate_snapshots():
+    """Drop cached snapshots once new callers are known to exist"""
+    global _snapshot_generation
+    _snapshot_generation += 1
+    _snapshot_cache.clear()
+
+async def get_snapshot(limit: Optional[int] = None, fresh: bool = False) -> tuple[list, bytes]:
+    """
+    Fetch the newest callers, shared by every request within SNAPSHOT_TTL
+
+    Args:
+        limit: Maximum number of callers to return, or None for all of them
+        fresh: Always query the database instead of reusing a cached snapshot;
+            these queries run concurrently instead of queueing on the lock
+
+    Returns:
+        Tuple of (callers newest first, the same callers encoded as JSON)
+    """
+    if fresh:
+        callers = await _query_callers(limit)
+        return callers, orjson.dumps(callers, default=str)
+
+    async with _snapshot_lock:
+        cached = _snapshot_cache.get(limit)
+        if cached is not None and time.monotonic() - cached[0] < SNAPSHOT_TTL:
+            return cached[1], cached[2]
+
+        generation = _snapshot_generation
+        callers = await _query_callers(limit)
+        body = orjson.dumps(callers, default=str)
+        # Rows that arrived during the query may be missing from it
+        if generation == _snapshot_generation:
+            _snapshot_cache[limit] = (time.monotonic(), callers, body)
+        return callers, body
 
 class Caller(BaseModel):
     latitude: float
@@ -35,77 +214,165 @@ class Caller(BaseModel):
 
 @app.post("/callers/")
 async def add_caller(caller: Caller):
-    as_dict = caller.dict(exclude_unset=True)
-    response = supabase.table("callers").insert(as_dict).execute()
+    as_dict = caller.model_dump(exclude_unset=True)
+    if app.state.pg is not None:
+        row = await app.state.pg.fetchrow(
+            f"INSERT INTO callers (latitude, longitude, severity, metadata) VALUES ($1, $2, $3, $4) RETURNING {CALLER_COLUMNS}",
+            as_dict["latitude"], as_dict["longitude"], as_dict["severity"], as_dict["metadata"],
+        )
+        created = dict(row)
+    else:
+        response = await asyncio.to_thread(supabase.table("callers").insert(as_dict).execute)
+        created = response.data[0]
+    _invalidate_snapshots()
 
-    return response.data[0]
+    return created
 
 @app.get("/callers/")
 async def get_callers():
     """Get all emergency calls from Supabase"""
-    response = supabase.table("callers").select("*").order("created_at", desc=True).execute()
-    return response.data
+    # The cache is only trusted while LISTEN is up: every worker then hears
+    # about every insert and invalidates its own copy. When polling, another
+    # worker may be the one that saw the new caller.
+    _, body = await get_snapshot(fresh=app.state.listener is None)
+    return Response(content=body, media_type="application/json")
 
-@app.get("/callers/stream")
-async def stream_callers():
-    """Server-Sent Events endpoint for real-time emergency call updates"""
-    async def event_stream():
-        # Track the last ID we've seen instead of timestamp (more reliable)
-        last_seen_id = 0
-        
-        # Send initial data and get the highest ID
-        initial_response = supabase.table("callers").select("*").order("created_at", desc=True).limit(10).execute()
-        if initial_response.data:
-            last_seen_id = max(caller['id'] for caller in initial_response.data)
-            data = {
-                "type": "initial",
-                "callers": initial_response.data,
-                "count": len(initial_response.data),
+async def push_updates(queue: asyncio.Queue, last_seen_id: int):
+    """Yield SSE frames for callers delivered by Postgres NOTIFY"""
+    snapshot_id = last_seen_id
+    while True:
+        try:
+            caller = await asyncio.wait_for(queue.get(), timeout=HEARTBEAT_INTERVAL)
+        except TimeoutError:
+            # Send heartbeat to keep connection alive
+            heartbeat = {
+                "type": "heartbeat",
                 "last_id": last_seen_id,
-                "timestamp": datetime.datetime.now().isoformat()
+                "timestamp": datetime.datetime.now()
             }
-            yield f"data: {json.dumps(data)}\n\n"
-        
-        while True:
-            try:
-                # Query for records with ID greater than last seen (much more reliable than timestamps)
-                response = supabase.table("callers").select("*").gt("id", last_seen_id).order("id", desc=False).execute()
-                
+            yield sse(heartbeat)
+            continue
+
+        # None means this client was dropped; ending the stream makes it reconnect
+        if caller is None:
+            return
+
+        # Send everything that arrived together as one batch
+        new_callers = [caller]
+        while not queue.empty():
+            caller = queue.get_nowait()
+            if caller is None:
+                return
+            new_callers.append(caller)
+
+        # Skip rows already sent in the initial snapshot. Each notification is
+        # queued once, and ids can commit out of order, so later rows are only
+        # compared against the snapshot and not against each other
+        new_callers = [caller for caller in new_callers if caller['id'] > snapshot_id]
+        if not new_callers:
+            continue
+
+        last_seen_id = max(last_seen_id, *(caller['id'] for caller in new_callers))
+        data = {
+            "type": "new_callers",
+            "new_callers": new_callers,
+            "count": len(new_callers),
+            "last_id": last_seen_id,
+            "timestamp": datetime.datetime.now()
+        }
+        yield sse(data)
+
+async def poll_updates(last_seen_id: int):
+    """Yield SSE frames for new callers by polling Supabase"""
+    interval = POLL_MIN
+    while True:
+        try:
+            # Query for records with ID greater than last seen (much more reliable than timestamps)
+            if app.state.pg is not None:
+                # asyncpg prepares this once per pooled connection and reuses the plan
+                rows = await app.state.pg.fetch(
+                    f"SELECT {CALLER_COLUMNS} FROM callers WHERE id > $1 ORDER BY id ASC LIMIT $2",
+                    last_seen_id, DELTA_LIMIT,
+                )
+                new_callers = [dict(row) for row in rows]
+            else:
+                response = await asyncio.to_thread(
+                    supabase.table("callers").select(CALLER_COLUMNS).gt("id", last_seen_id).order("id", desc=False).limit(DELTA_LIMIT).execute
+                )
                 new_callers = response.data if response.data else []
+            
+            if new_callers:
+                # Update last seen ID to the highest new ID
+                last_seen_id = max(caller['id'] for caller in new_callers)
+                _invalidate_snapshots()
                 
-                if new_callers:
-                    # Update last seen ID to the highest new ID
-                    last_seen_id = max(caller['id'] for caller in new_callers)
-                    
-                    # Only send the NEW callers
-                    data = {
-                        "type": "new_callers",
-                        "new_callers": new_callers,
-                        "count": len(new_callers),
-                        "last_id": last_seen_id,
-                        "timestamp": datetime.datetime.now().isoformat()
-                    }
-                    yield f"data: {json.dumps(data)}\n\n"
-                else:
-                    # Send heartbeat to keep connection alive
-                    heartbeat = {
-                        "type": "heartbeat",
-                        "last_id": last_seen_id,
-                        "timestamp": datetime.datetime.now().isoformat()
-                    }
-                    yield f"data: {json.dumps(heartbeat)}\n\n"
-                
-                # Wait 2 seconds before next check
-                await asyncio.sleep(2)
-            except Exception as e:
-                # Send error message and continue
-                error_data = {
-                    "type": "error",
-                    "message": str(e),
-                    "timestamp": datetime.datetime.now().isoformat()
+                # Only send the NEW callers
+                data = {
+                    "type": "new_callers",
+                    "new_callers": new_callers,
+                    "count": len(new_callers),
+                    "last_id": last_seen_id,
+                    "timestamp": datetime.datetime.now()
                 }
-                yield f"data: {json.dumps(error_data)}\n\n"
-                await asyncio.sleep(5)  # Wait longer on error
+                yield sse(data)
+                interval = POLL_MIN
+            else:
+                # Send heartbeat to keep connection alive
+                heartbeat = {
+                    "type": "heartbeat",
+                    "last_id": last_seen_id,
+                    "timestamp": datetime.datetime.now()
+                }
+                yield sse(heartbeat)
+                interval = min(interval * POLL_BACKOFF, POLL_MAX)
+            
+            await asyncio.sleep(interval)
+        except Exception as e:
+            # Send error message and continue
+            error_data = {
+                "type": "error",
+                "message": str(e),
+                "timestamp": datetime.datetime.now()
+            }
+            yield sse(error_data)
+            await asyncio.sleep(5)  # Wait longer on error
+            interval = POLL_MIN
+
+@app.get("/callers/stream")
+async def stream_callers():
+    """Server-Sent Events endpoint for real-time emergency call updates"""
+    async def event_stream():
+        # Subscribe before the snapshot so no insert falls between the two
+        queue = None
+        if app.state.listener is not None:
+            queue = asyncio.Queue(maxsize=SUBSCRIBER_BACKLOG)
+            _subscribers.add(queue)
+
+        try:
+            # Track the last ID we've seen instead of timestamp (more reliable)
+            last_seen_id = 0
+            
+            # Send initial data and get the highest ID. The snapshot must be read
+            # after subscribing: a cached one could predate rows whose NOTIFY
+            # arrived before the subscription, and those would then be skipped
+            initial_callers, _ = await get_snapshot(limit=10, fresh=True)
+            if initial_callers:
+                last_seen_id = max(caller['id'] for caller in initial_callers)
+                data = {
+                    "type": "initial",
+                    "callers": initial_callers,
+                    "count": len(initial_callers),
+                    "last_id": last_seen_id,
+                    "timestamp": datetime.datetime.now()
+                }
+                yield sse(data)
+
+            updates = push_updates(queue, last_seen_id) if queue is not None else poll_updates(last_seen_id)
+            async for frame in updates:
+                yield frame
+        finally:
+            if queue is not None:
+                _subscribers.discard(queue)
     
     return StreamingResponse(event_stream(), media_type="text/event-stream", headers={
         "Cache-Control": "no-cache",
@@ -114,10 +381,27 @@ async def stream_callers():
         "Access-Control-Allow-Headers": "Cache-Control"
     })
 
+_ROOT_JSON = orjson.dumps({"message": "Hello from FastAPI!"})
+
 @app.get("/")
 def read_root():
-    return {"message": "Hello from FastAPI!"}
+    return Response(content=_ROOT_JSON, media_type="application/json")
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=5001)
\ No newline at end of file
+
+    try:
+        import uvloop
+    except ImportError:  # uvloop doesn't support Windows
+        uvloop = None
+
+    # Workers need the app as an import string so each process can load it
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=5001,
+        loop="uvloop" if uvloop else "asyncio",
+        http="httptools",
+        workers=int(os.getenv("WEB_CONCURRENCY", max(2, os.cpu_count() or 1))),
+        backlog=2048,
+    )
\ No newline at end of file
@@ -4,25 +4,55 @@ Handles emergency call classification and AI voice agent for non-emergencies
 """
 
 import asyncio
+import logging
 import os
 import random
 import sys
 from contextlib import asynccontextmanager
+from logging.handlers import QueueHandler, QueueListener
+from queue import SimpleQueue
+from xml.sax.saxutils import escape
 from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect
 from fastapi.responses import Response
-from twilio.twiml.voice_response import VoiceResponse
+from twilio.twiml.voice_response import Redirect, VoiceResponse
+import orjson
 import uvicorn
+from websockets.exceptions import ConnectionClosedOK
 from dotenv import load_dotenv
-from supabase import create_client, Client
+from supabase import acreate_client
 from pydantic import BaseModel
 
 from emergency_classifier import EmergencyClassifier
 from twilio_webhook import webhook_handler
 from voice_agent import DeepgramVoiceAgent
-from groq_inference import get_call_summary, get_criticality_level
+from groq_inference.client import aclose as close_groq_client, client as groq_client
 
 load_dotenv()
 
+# Read once at import; these don't change while the server is running
+EMERGENCY_DISPATCH_NUMBER = os.getenv("EMERGENCY_DISPATCH_PHONE_NUMBER")
+VOICE_AGENT_WS_URL = os.getenv("VOICE_AGENT_WS_URL", "wss://your-ngrok-url.ngrok.io/twilio")
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", max(2, os.cpu_count() or 1)))
+# Opt-in: open the Deepgram session while Twilio connects the stream. Prewarmed
+# sessions live in one process, and the stream can land on any worker, so
+# "auto" only prewarms with a single worker; "true" is for deployments that
+# route a call's webhooks and stream to the same worker.
+VOICE_AGENT_PREWARM = os.getenv("VOICE_AGENT_PREWARM", "auto").lower()
+PREWARM_VOICE_AGENT = VOICE_AGENT_PREWARM == "true" or (VOICE_AGENT_PREWARM == "auto" and WEB_CONCURRENCY == 1)
+
+# Handlers only enqueue records; a listener thread started in the lifespan
+# writes them out, so request handlers never block on stdout
+logger = logging.getLogger(__name__)
+_log_records = SimpleQueue()
+for _logger in (logger, logging.getLogger("voice_agent")):
+    _logger.setLevel(LOG_LEVEL)
+    _logger.propagate = False
+    _logger.addHandler(QueueHandler(_log_records))
+_log_output = logging.StreamHandler()
+_log_output.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+_log_listener = QueueListener(_log_records, _log_output)
+
 def add_random_offset_to_coordinates(lat: float, lon: float, max_offset_feet: float = 500) -> tuple[float, float]:
     """
     Add random offset to coordinates within specified distance in feet.
@@ -52,7 +82,55 @@ def add_random_offset_to_coordinates(lat: float, lon: float, max_offset_feet: fl
     return new_lat, new_lon
 
 # Initialize services
-emergency_classifier = EmergencyClassifier()
+# Fixed TwiML responses are rendered once at import rather than on every request
+SPEECH_GATHER_CONFIG = {
+    'input': 'speech',
+    'action': '/webhook/process-speech',
+    'method': 'POST',
+    'speech_timeout': 2,
+    'timeout': 15,
+    'language': 'en-US'
+}
+
+_REDIRECT_TO_VOICE_XML = str(VoiceResponse().append(Redirect("/webhook/voice"))).encode()
+
+_GREETING_XML = webhook_handler.create_voice_response(
+    message="Nine one one, what is your emergency.",
+    gather_config=SPEECH_GATHER_CONFIG
+).encode()
+
+_NO_SPEECH_XML = webhook_handler.create_voice_response(
+    message="I didn't catch that. Please tell me what's happening.",
+    gather_config=SPEECH_GATHER_CONFIG
+).encode()
+
+_ERROR_XML = webhook_handler.create_hangup_response(
+    "I'm sorry, there was an error. Please try again."
+).encode()
+
+_PROCESSING_ERROR_XML = webhook_handler.create_hangup_response(
+    "I'm sorry, there was an error processing your request."
+).encode()
+
+# Same markup the twilio SDK produces for say + connect/stream; only the URL varies
+_CONNECT_STREAM_TEMPLATE = (
+    '<?xml version="1.0" encoding="UTF-8"?><Response>'
+    '<Say>Connecting you to an assistant now.</Say>'
+    '<Connect><Stream url="{url}" /></Connect>'
+    '</Response>'
+)
+
+_CONNECT_VOICE_AGENT_XML = _CONNECT_STREAM_TEMPLATE.format(
+    url=escape(VOICE_AGENT_WS_URL, {'"': "&quot;"})
+).encode()
+
+_EMERGENCY_TRANSFER_XML = webhook_handler.create_dial_response(
+    phone_number=EMERGENCY_DISPATCH_NUMBER,
+    message="This appears to be an emergency. I'm transferring you to a human dispatcher now."
+).encode()
+
+# Shares the pooled Groq client that the lifespan closes on shutdown
+emergency_classifier = EmergencyClassifier(groq_client)
 
 class Caller(BaseModel):
     latitude: float
@@ -63,13 +141,114 @@ class Caller(BaseModel):
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+# Strong references to fire-and-forget tasks so they aren't garbage collected mid-run
+_background_tasks: set[asyncio.Task] = set()
+
+def run_in_background(coro):
+    """Schedule work that the webhook response shouldn't wait for"""
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+# Caller rows are queued by the webhooks and written by a single background worker
+WRITE_QUEUE_SIZE = 1000
+WRITE_BATCH_SIZE = 50
+# Seconds to wait on shutdown for queued rows to be written
+WRITE_FLUSH_TIMEOUT = 5
+
+async def save_callers(rows: list[dict]):
+    """Insert caller rows in one request; PostgREST is asked not to echo them back"""
+    try:
+        await app.state.supabase.table("callers").insert(rows, returning="minimal").execute()
+        logger.info("saved %d caller(s) to database", len(rows))
+    except Exception as e:
+        logger.error("❌ Error saving callers: %s", e)
+
+async def caller_writer(queue: asyncio.Queue):
+    """Drain the write queue, inserting whatever has accumulated as one batch"""
+    while True:
+        batch = [await queue.get()]
+        while not queue.empty() and len(batch) < WRITE_BATCH_SIZE:
+            batch.append(queue.get_nowait())
+        await save_callers(batch)
+        for _ in batch:
+            queue.task_done()
+
+def queue_caller(caller_data: dict):
+    """Queue a caller row for the background writer"""
+    try:
+        app.state.write_queue.put_nowait(caller_data)
+    except asyncio.QueueFull:
+        # Never drop a caller; write this one on its own instead
+        run_in_background(save_callers([caller_data]))
+
+# Webhook logs are best effort: under overload they're dropped, never waited on
+LOG_QUEUE_SIZE = 10_000
+
+async def webhook_logger(queue: asyncio.Queue):
+    """Write queued webhook logs outside the request path"""
+    while True:
+        request, endpoint, call_data = await queue.get()
+        try:
+            await webhook_handler.log_webhook_request(request, endpoint, call_data)
+        except Exception as e:
+            logger.error("❌ Error logging webhook: %s", e)
+
+def queue_webhook_log(request: Request, endpoint: str, call_data: dict):
+    """Queue a webhook log entry, dropping it if the logger has fallen behind"""
+    try:
+        app.state.log_queue.put_nowait((request, endpoint, call_data))
+    except asyncio.QueueFull:
+        pass
+
+# Severity labels as stored in the callers table
+_SEVERITY = {"CRITICAL": 4, "HIGH": 3, "MEDIUM": 2, "LOW": 1}
+
+def record_caller(speech_summary: str, severity: int):
+    """Queue the caller for the dashboard"""
+    # Sid's code: sending to supabase
+    
+    # Original coordinates (San Francisco area)
+    original_lat = 37.8029
+    original_lon = -122.44879
+    
+    # Add random offset within ±250 feet
+    randomized_lat, randomized_lon = add_random_offset_to_coordinates(original_lat, original_lon)
+    
+    caller_data = {
+            "latitude": randomized_lat,
+            "longitude": randomized_lon,
+            "severity": severity,
+            "metadata": speech_summary
+            }
+    # Validate before queueing: one bad row would fail the whole batch insert
+    queue_caller(Caller.model_validate(caller_data).model_dump())
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Startup and shutdown events"""
-    print("🎤 Voice Agent WebSocket available on /twilio")
+    _log_listener.start()
+    logger.info("🎤 Voice Agent WebSocket available on /twilio")
+    # Shared so a session prewarmed by process_speech can be claimed by /twilio;
+    # created here because it needs DEEPGRAM_API_KEY, which main() checks first
+    app.state.voice_agent = DeepgramVoiceAgent()
+    # The async client writes callers on the event loop instead of a worker thread
+    app.state.supabase = await acreate_client(SUPABASE_URL, SUPABASE_KEY)
+    app.state.write_queue = asyncio.Queue(maxsize=WRITE_QUEUE_SIZE)
+    writer = asyncio.create_task(caller_writer(app.state.write_queue))
+    app.state.log_queue = asyncio.Queue(maxsize=LOG_QUEUE_SIZE)
+    log_worker = asyncio.create_task(webhook_logger(app.state.log_queue))
     yield
+    log_worker.cancel()
+    try:
+        await asyncio.wait_for(app.state.write_queue.join(), timeout=WRITE_FLUSH_TIMEOUT)
+    except TimeoutError:
+        logger.warning("⚠️  %d caller(s) not saved before shutdown", app.state.write_queue.qsize())
+    writer.cancel()
+    await app.state.supabase.postgrest.aclose()
+    await close_groq_client()
+    _log_listener.stop()
 
 app = FastAPI(
     title="911 Dispatch Voice Agent",
@@ -78,23 +257,27 @@ app = FastAPI(
     lifespan=lifespan
 )
 
+# Static bodies for the probe endpoints, encoded once
+_ROOT_JSON = orjson.dumps({"message": "911 Dispatch Voice Agent API"})
+_HEALTH_JSON = orjson.dumps({
+    "status": "healthy",
+    "message": "911 Dispatch Voice Agent is running",
+    "endpoints": {
+        "voice_webhook": "/webhook/voice",
+        "process_speech": "/webhook/process-speech",
+        "voice_agent_websocket": "/twilio"
+    }
+})
+
 @app.get("/")
 def root():
     """Root endpoint"""
-    return {"message": "911 Dispatch Voice Agent API"}
+    return Response(content=_ROOT_JSON, media_type="application/json")
 
 @app.get("/health")
 def health_check():
     """Health check endpoint"""
-    return {
-        "status": "healthy",
-        "message": "911 Dispatch Voice Agent is running",
-        "endpoints": {
-            "voice_webhook": "/webhook/voice",
-            "process_speech": "/webhook/process-speech",
-            "voice_agent_websocket": "/twilio"
-        }
-    }
+    return Response(content=_HEALTH_JSON, media_type="application/json")
 
 @app.post("/")
 async def handle_root_post(request: Request):
@@ -104,46 +287,26 @@ async def handle_root_post(request: Request):
         call_sid = form_data.get("CallSid")
         from_number = form_data.get("From")
         
-        print(f"📞 Incoming call from {from_number}, CallSid: {call_sid}")
+        logger.info("📞 Incoming call from %s, CallSid: %s", from_number, call_sid)
         
-        response = VoiceResponse()
-        response.redirect("/webhook/voice")
-        return Response(content=str(response), media_type="application/xml")
+        return Response(content=_REDIRECT_TO_VOICE_XML, media_type="application/xml")
         
     except Exception as e:
-        print(f"❌ Error handling root POST: {e}")
-        response = VoiceResponse()
-        response.say("I'm sorry, there was an error. Please try again.")
-        response.hangup()
-        return Response(content=str(response), media_type="application/xml")
+        logger.error("❌ Error handling root POST: %s", e)
+        return Response(content=_ERROR_XML, media_type="application/xml")
 
 @app.post("/webhook/voice")
 async def handle_incoming_call(request: Request):
     """Handle incoming Twilio voice calls"""
     try:
         call_data = await webhook_handler.extract_call_data(request)
-        await webhook_handler.log_webhook_request(request, "/webhook/voice", call_data)
+        queue_webhook_log(request, "/webhook/voice", call_data)
         
-        twiml_response = webhook_handler.create_voice_response(
-            message="Nine one one, what is your emergency.",
-            gather_config={
-                'input': 'speech',
-                'action': '/webhook/process-speech',
-                'method': 'POST',
-                'speech_timeout': 2,
-                'timeout': 15,
-                'language': 'en-US'
-            }
-        )
-        
-        return Response(content=twiml_response, media_type="application/xml")
+        return Response(content=_GREETING_XML, media_type="application/xml")
         
     except Exception as e:
-        print(f"❌ Error handling incoming call: {e}")
-        error_response = webhook_handler.create_hangup_response(
-            "I'm sorry, there was an error. Please try again."
-        )
-        return Response(content=error_response, media_type="application/xml")
+        logger.error("❌ Error handling incoming call: %s", e)
+        return Response(content=_ERROR_XML, media_type="application/xml")
 
 @app.post("/webhook/process-speech")
 async def process_speech(request: Request):
@@ -152,139 +315,102 @@ async def process_speech(request: Request):
         call_data = await webhook_handler.extract_call_data(request)
         speech_result = call_data.get("speech_result", "")
         
-        await webhook_handler.log_webhook_request(request, "/webhook/process-speech", call_data)
+        queue_webhook_log(request, "/webhook/process-speech", call_data)
         
-        print(f"🎤 Speech: {speech_result}")
-        print(f"🎯 Confidence: {call_data.get('confidence', 'N/A')}")
+        logger.debug("🎤 Speech: %s", speech_result)
+        logger.debug("🎯 Confidence: %s", call_data.get('confidence', 'N/A'))
         
         if not speech_result.strip():
-            print("⚠️  No speech detected, asking again")
-            twiml_response = webhook_handler.create_voice_response(
-                message="I didn't catch that. Please tell me what's happening.",
-                gather_config={
-                    'input': 'speech',
-                    'action': '/webhook/process-speech',
-                    'method': 'POST',
-                    'speech_timeout': 2,
-                    'timeout': 15,
-                    'language': 'en-US'
-                }
-            )
-            return Response(content=twiml_response, media_type="application/xml")
-        
-        # Classify the call using AI
-        print("🤖 Classifying call...")
-        classification_result = await emergency_classifier.classify_call(speech_result)
-        speech_summary = await get_call_summary(speech_result)
-        severity_as_enum = await get_criticality_level(speech_result)
-        print("Speech Summary", speech_summary)
-        enum_to_int = {"CRITICAL": 4, "HIGH":3, "MEDIUM":2, "LOW":1}
-        if severity_as_enum not in enum_to_int:
-            print("Severity errored, defaulting to HIGH")
-            severity_as_enum = "HIGH"
-        else:
-            print("Severity:", severity_as_enum)
-        
-        print(f"📊 Classification: {classification_result}")
-        
-        # Sid's code: sending to supabase
+            logger.info("⚠️  No speech detected, asking again")
+            return Response(content=_NO_SPEECH_XML, media_type="application/xml")
         
-        severity = enum_to_int[severity_as_enum]
+        # Severity and summary come back from a single Groq call; routing follows severity
+        logger.debug("🤖 Classifying call...")
+        triage = await emergency_classifier.triage_call(speech_result)
+        logger.debug("Speech Summary %s", triage.summary)
+        logger.debug("Severity: %s", triage.severity)
+        logger.info("📊 Classification: %s", triage)
         
-        # Original coordinates (San Francisco area)
-        original_lat = 37.8029
-        original_lon = -122.44879
+        record_caller(triage.summary, _SEVERITY[triage.severity])
         
-        # Add random offset within ±250 feet
-        randomized_lat, randomized_lon = add_random_offset_to_coordinates(original_lat, original_lon)
-        
-        caller_data = {
-                "latitude": randomized_lat,
-                "longitude": randomized_lon,
-                "severity": severity,
-                "metadata": speech_summary
-                }
-        response = supabase.table("callers").insert(caller_data).execute()
-        print(f"saved caller to database: {response}")
-        
-        if classification_result["is_emergency"]:
+        if triage.is_emergency:
             # Emergency - transfer to human dispatcher
-            emergency_number = os.getenv("EMERGENCY_DISPATCH_PHONE_NUMBER")
-            print(f"🚨 EMERGENCY - Transferring to {emergency_number}")
-            
-            twiml_response = webhook_handler.create_dial_response(
-                phone_number=emergency_number,
-                message="This appears to be an emergency. I'm transferring you to a human dispatcher now."
-            )
+            logger.info("🚨 EMERGENCY - Transferring to %s", EMERGENCY_DISPATCH_NUMBER)
+            twiml_response = _EMERGENCY_TRANSFER_XML
         else:
             # Non-emergency - connect to AI voice agent
-            print("📞 Non-emergency - connecting to AI voice agent")
-            
-            voice_agent_url = os.getenv("VOICE_AGENT_WS_URL", "wss://your-ngrok-url.ngrok.io/twilio")
-            
-            response = VoiceResponse()
-            response.say("Connecting you to an assistant now.")
-            response.connect().stream(url=voice_agent_url)
-            
-            twiml_response = str(response)
+            logger.info("📞 Non-emergency - connecting to AI voice agent")
+            # Open the agent session while Twilio fetches the TwiML and connects
+            # the stream
+            if PREWARM_VOICE_AGENT:
+                request.app.state.voice_agent.prewarm(call_data.get("call_sid"))
+            twiml_response = _CONNECT_VOICE_AGENT_XML
         
         return Response(content=twiml_response, media_type="application/xml")
         
     except Exception as e:
-        print(f"❌ Error processing speech: {e}")
-        error_response = webhook_handler.create_hangup_response(
-            "I'm sorry, there was an error processing your request."
-        )
-        return Response(content=error_response, media_type="application/xml")
+        logger.error("❌ Error processing speech: %s", e)
+        return Response(content=_PROCESSING_ERROR_XML, media_type="application/xml")
+
+class FastAPIWebSocketWrapper:
+    """Adapts a FastAPI WebSocket to the websockets-style interface the voice agent uses"""
+    def __init__(self, websocket: WebSocket):
+        self.websocket = websocket
+        self.closed = False
+        # Bound once; send and receive run for every 20ms audio frame
+        self._send_text = websocket.send_text
+        self._send_bytes = websocket.send_bytes
+        self._receive_text = websocket.receive_text
+    
+    async def send(self, data):
+        # A send after Twilio hung up raises what a websockets connection would,
+        # so the voice agent handles both sockets' hangups the same way
+        if self.closed:
+            raise ConnectionClosedOK(None, None)
+        try:
+            if type(data) is str:
+                await self._send_text(data)
+            else:
+                await self._send_bytes(data)
+        except WebSocketDisconnect:
+            self.closed = True
+            raise ConnectionClosedOK(None, None)
+    
+    async def recv(self):
+        return await self._receive_text()
+    
+    async def close(self, code=None, reason=None):
+        self.closed = True
+        await self.websocket.close(code=code, reason=reason)
+    
+    def __aiter__(self):
+        return self
+    
+    async def __anext__(self):
+        if self.closed:
+            raise StopAsyncIteration
+        try:
+            return await self._receive_text()
+        except WebSocketDisconnect:
+            self.closed = True
+            raise StopAsyncIteration
 
 @app.websocket("/twilio")
 async def voice_agent_websocket(websocket: WebSocket):
     """WebSocket endpoint for Deepgram voice agent"""
-    print("🎤 WebSocket connection received on /twilio")
+    logger.info("🎤 WebSocket connection received on /twilio")
     await websocket.accept()
-    print("✅ WebSocket connection accepted")
+    logger.debug("✅ WebSocket connection accepted")
     
     try:
-        # Create compatibility wrapper for FastAPI WebSocket
-        class FastAPIWebSocketWrapper:
-            def __init__(self, websocket):
-                self.websocket = websocket
-                self.closed = False
-            
-            async def send(self, data):
-                if isinstance(data, str):
-                    await self.websocket.send_text(data)
-                else:
-                    await self.websocket.send_bytes(data)
-            
-            async def recv(self):
-                return await self.websocket.receive_text()
-            
-            async def close(self, code=None, reason=None):
-                self.closed = True
-                await self.websocket.close(code=code, reason=reason)
-            
-            def __aiter__(self):
-                return self
-            
-            async def __anext__(self):
-                if self.closed:
-                    raise StopAsyncIteration
-                try:
-                    return await self.websocket.receive_text()
-                except WebSocketDisconnect:
-                    self.closed = True
-                    raise StopAsyncIteration
-        
         # Use the voice agent
         wrapped_websocket = FastAPIWebSocketWrapper(websocket)
-        voice_agent = DeepgramVoiceAgent()
-        await voice_agent.twilio_handler(wrapped_websocket)
+        await websocket.app.state.voice_agent.twilio_handler(wrapped_websocket)
         
     except WebSocketDisconnect:
-        print("🔌 WebSocket disconnected")
+        logger.info("🔌 WebSocket disconnected")
     except Exception as e:
-        print(f"❌ Error in voice agent: {e}")
+        logger.error("❌ Error in voice agent: %s", e)
         try:
             await websocket.close(code=1011, reason="Voice agent error")
         except:
@@ -320,7 +446,23 @@ def main():
     print("🚀 Starting server on port 8000...")
     print()
     
-    uvicorn.run(app, host="0.0.0.0", port=8000, log_level="info")
+    try:
+        import uvloop
+    except ImportError:  # uvloop doesn't support Windows
+        uvloop = None
+
+    # Workers need the app as an import string so each process can load it.
+    # Twilio's media stream is base64 mulaw, which deflate can't shrink.
+    uvicorn.run(
+        "server:app",
+        host="0.0.0.0",
+        port=8000,
+        log_level="info",
+        loop="uvloop" if uvloop else "asyncio",
+        http="httptools",
+        ws_per_message_deflate=False,
+        workers=WEB_CONCURRENCY,
+    )
 
 if __name__ == "__main__":
     main()
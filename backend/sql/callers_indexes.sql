@@ -0,0 +1,6 @@
+-- Indexes for the callers queries in main.py. Run once against the Supabase database.
+-- The SSE delta query (id > $1 ORDER BY id LIMIT 100) is served by the primary key.
+
+-- Newest-first snapshot (ORDER BY created_at DESC LIMIT n). A btree is used
+-- because BRIN can only filter ranges and cannot return rows in order.
+create index if not exists callers_created_at_idx on callers (created_at desc);
@@ -0,0 +1,18 @@
+-- Publish the id of every new caller on the callers_insert channel so the SSE
+-- stream in main.py can push it instead of polling. Only the id is sent: NOTIFY
+-- payloads are capped at 8000 bytes, and going over would abort the insert.
+-- Run once against the Supabase database.
+
+create or replace function notify_callers_insert() returns trigger
+language plpgsql as $$
+begin
+    perform pg_notify('callers_insert', new.id::text);
+    return new;
+end;
+$$;
+
+drop trigger if exists callers_insert_notify on callers;
+
+create trigger callers_insert_notify
+after insert on callers
+for each row execute function notify_callers_insert();
@@ -8,10 +8,16 @@ import os
 import sys
 from dotenv import load_dotenv
 
+try:
+    import uvloop
+except ImportError:  # uvloop doesn't support Windows
+    uvloop = None
+
 # Add the current directory to Python path
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 from emergency_classifier import EmergencyClassifier
+from groq_inference.prefilter import quick_criticality
 
 load_dotenv()
 
@@ -57,18 +63,26 @@ class SystemTester:
         passed = 0
         total = len(test_cases)
         
-        for i, test_case in enumerate(test_cases, 1):
+        # Triage every case as one batch, then report them in order
+        try:
+            results = await self.classifier.triage_batch([test_case['transcript'] for test_case in test_cases])
+        except Exception as e:
+            print(f"❌ ERROR: {e}")
+            return False
+        
+        if len(results) != total:
+            print(f"❌ FAIL - Batch returned {len(results)} results for {total} calls")
+            return False
+        
+        for i, (test_case, result) in enumerate(zip(test_cases, results), 1):
             print(f"\nTest {i}: {test_case['description']}")
             print(f"Transcript: \"{test_case['transcript']}\"")
             
             try:
-                result = await self.classifier.classify_call(test_case['transcript'])
-                is_emergency = result['is_emergency']
-                classification = result['classification']
-                confidence = result['confidence']
+                is_emergency = result.is_emergency
                 
-                print(f"Result: {classification} (Emergency: {is_emergency})")
-                print(f"Confidence: {confidence}")
+                print(f"Result: {result.severity} (Emergency: {is_emergency})")
+                print(f"Summary: {result.summary}")
                 
                 # Check if result matches expected
                 expected_emergency = test_case['expected'] == 'EMERGENCY'
@@ -84,6 +98,36 @@ class SystemTester:
         print(f"\n📊 Results: {passed}/{total} tests passed")
         return passed == total
     
+    def test_prefilter(self):
+        """Test the keyword prefilter that resolves CRITICAL calls without Groq"""
+        print("\n⚡ Testing Keyword Prefilter")
+        print("=" * 40)
+        
+        # None means the call must go to Groq; the prefilter never rules
+        # an emergency out, and ignores negated or past mentions
+        test_cases = [
+            ("He's not breathing, please hurry!", "CRITICAL"),
+            ("My mom is unconscious on the kitchen floor", "CRITICAL"),
+            ("My husband fell, and he isn't breathing", "CRITICAL"),
+            ("He's not unconscious anymore, he just woke up", None),
+            ("She was unconscious earlier but she's talking now", None),
+            ("My dad had a heart attack last year and feels dizzy", None),
+            ("Where is the nearest shelter? My son is having a seizure", None),
+            ("How do I get to the hospital, she swallowed a bottle of pills", None),
+            ("Where can I find my daughter, she's missing", None),
+        ]
+        
+        passed = 0
+        for transcript, expected in test_cases:
+            level = quick_criticality(transcript)
+            if level == expected:
+                passed += 1
+            else:
+                print(f"❌ FAIL - \"{transcript}\": got {level}, expected {expected}")
+        
+        print(f"📊 Results: {passed}/{len(test_cases)} tests passed")
+        return passed == len(test_cases)
+    
     def test_environment_configuration(self):
         """Test environment configuration"""
         print("\n🔧 Testing Environment Configuration")
@@ -151,17 +195,20 @@ class SystemTester:
         # Test 1: Emergency Classification
         classification_ok = await self.test_emergency_classification()
         
-        # Test 2: Environment Configuration
+        # Test 2: Keyword Prefilter
+        prefilter_ok = self.test_prefilter()
+        
+        # Test 3: Environment Configuration
         config_ok = self.test_environment_configuration()
         
-        # Test 3: WebSocket URL
+        # Test 4: WebSocket URL
         url_ok = self.test_websocket_url()
         
         # Summary
         print("\n📊 Test Summary")
         print("=" * 50)
         
-        all_passed = classification_ok and config_ok and url_ok
+        all_passed = classification_ok and prefilter_ok and config_ok and url_ok
         
         if all_passed:
             print("✅ All tests passed! System is ready for testing.")
@@ -181,4 +228,4 @@ async def main():
     await tester.run_all_tests()
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main(), loop_factory=uvloop.new_event_loop if uvloop else None)
\ No newline at end of file
@@ -4,10 +4,10 @@ Based on official Twilio documentation and security guidelines
 """
 
 import os
+import sys
 import hmac
-import hashlib
 import base64
-from urllib.parse import urlencode
+from urllib.parse import parse_qsl, urlencode
 from typing import Dict, Any, Optional
 from fastapi import Request, HTTPException
 from twilio.twiml.voice_response import VoiceResponse
@@ -16,6 +16,9 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
+# Read once at import rather than on every webhook
+VALIDATE_WEBHOOKS = os.getenv("VALIDATE_TWILIO_WEBHOOKS", "false").lower() == "true"
+
 class TwilioWebhookValidator:
     """
     Validates Twilio webhook requests using X-Twilio-Signature header
@@ -24,6 +27,8 @@ class TwilioWebhookValidator:
     
     def __init__(self, auth_token: str):
         self.auth_token = auth_token
+        # Encoded once; None when the token is unset, so nothing validates
+        self._key = auth_token.encode('utf-8') if auth_token else None
     
     async def validate_request(self, request: Request, webhook_url: str) -> bool:
         """
@@ -36,6 +41,12 @@ class TwilioWebhookValidator:
         Returns:
             True if request is valid, False otherwise
         """
+        # Without a token any HMAC would be computed with an empty key, which
+        # anyone can forge
+        if self._key is None:
+            print("Warning: TWILIO_AUTH_TOKEN not set, rejecting webhook")
+            return False
+        
         try:
             # Get the signature from the request headers
             signature = request.headers.get("X-Twilio-Signature", "")
@@ -67,15 +78,9 @@ class TwilioWebhookValidator:
         Returns:
             Base64-encoded signature
         """
-        # Create the string to sign
-        string_to_sign = url + body.decode('utf-8')
-        
-        # Create HMAC signature
-        signature = hmac.new(
-            self.auth_token.encode('utf-8'),
-            string_to_sign.encode('utf-8'),
-            hashlib.sha1
-        ).digest()
+        # Sign the URL followed by the body, joined as bytes so the body
+        # isn't decoded and re-encoded
+        signature = hmac.digest(self._key, url.encode('utf-8') + body, 'sha1')
         
         # Return base64-encoded signature
         return base64.b64encode(signature).decode('utf-8')
@@ -188,19 +193,27 @@ class TwilioWebhookHandler:
         
         return str(response)
     
-    async def extract_call_data(self, request: Request) -> Dict[str, Any]:
+    async def extract_call_data(self, request: Request, include_raw: bool = False) -> Dict[str, Any]:
         """
         Extract relevant call data from the webhook request
         
         Args:
             request: FastAPI Request object
+            include_raw: Also return every form field under "raw_data"
             
         Returns:
             Dictionary containing call information
         """
-        form_data = await request.form()
+        # Read the raw body first so Starlette caches it for signature
+        # validation. Twilio posts urlencoded forms, which are parsed straight
+        # from those bytes instead of through Starlette's streaming form parser.
+        body = await request.body()
+        if request.headers.get("content-type", "").startswith("application/x-www-form-urlencoded"):
+            form_data = dict(parse_qsl(body.decode("utf-8"), keep_blank_values=True))
+        else:
+            form_data = await request.form()
         
-        return {
+        call_data = {
             "call_sid": form_data.get("CallSid"),
             "from_number": form_data.get("From"),
             "to_number": form_data.get("To"),
@@ -208,8 +221,11 @@ class TwilioWebhookHandler:
             "direction": form_data.get("Direction"),
             "speech_result": form_data.get("SpeechResult", ""),
             "confidence": form_data.get("Confidence", ""),
-            "raw_data": dict(form_data)
         }
+        # Copying the whole form is only worth it when a caller wants it
+        if include_raw:
+            call_data["raw_data"] = dict(form_data)
+        return call_data
     
     async def log_webhook_request(self, request: Request, endpoint: str, call_data: Dict[str, Any]):
         """
@@ -220,21 +236,25 @@ class TwilioWebhookHandler:
             endpoint: The webhook endpoint
             call_data: Extracted call data
         """
-        print(f"📞 Twilio Webhook: {endpoint}")
-        print(f"   Call SID: {call_data.get('call_sid', 'N/A')}")
-        print(f"   From: {call_data.get('from_number', 'N/A')}")
-        print(f"   To: {call_data.get('to_number', 'N/A')}")
-        print(f"   Status: {call_data.get('call_status', 'N/A')}")
-        print(f"   Speech: {call_data.get('speech_result', 'N/A')}")
-        print(f"   Confidence: {call_data.get('confidence', 'N/A')}")
-        
         # Only validate if validation is enabled
-        if os.getenv("VALIDATE_TWILIO_WEBHOOKS", "false").lower() == "true":
+        if VALIDATE_WEBHOOKS:
             is_valid = await self.validate_webhook(request, endpoint)
-            print(f"   Valid: {is_valid}")
+            valid = str(is_valid)
         else:
-            print(f"   Valid: N/A (validation disabled)")
-        print("---")
+            valid = "N/A (validation disabled)"
+        
+        # One write for the whole entry instead of a print per line
+        sys.stdout.write(
+            f"📞 Twilio Webhook: {endpoint}\n"
+            f"   Call SID: {call_data.get('call_sid', 'N/A')}\n"
+            f"   From: {call_data.get('from_number', 'N/A')}\n"
+            f"   To: {call_data.get('to_number', 'N/A')}\n"
+            f"   Status: {call_data.get('call_status', 'N/A')}\n"
+            f"   Speech: {call_data.get('speech_result', 'N/A')}\n"
+            f"   Confidence: {call_data.get('confidence', 'N/A')}\n"
+            f"   Valid: {valid}\n"
+            "---\n"
+        )
 
 # Global webhook handler instance
 webhook_handler = TwilioWebhookHandler()
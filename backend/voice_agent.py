@@ -4,15 +4,135 @@ Handles real-time voice conversations with callers
 """
 
 import asyncio
-import base64
-import json
+import binascii
+import logging
 import os
+from collections import deque
+import orjson
 import websockets
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 from dotenv import load_dotenv
 
 load_dotenv()
 
+DEEPGRAM_AGENT_URL = "wss://agent.deepgram.com/v1/agent/converse"
+
+# The server routes these records through its queue listener, so the audio
+# pumps never block on stdout
+logger = logging.getLogger(__name__)
+
+# Configure the voice agent for emergency dispatch context
+AGENT_SETTINGS = {
+    "type": "Settings",
+    "audio": {
+        "input": {
+            "encoding": "mulaw",
+            "sample_rate": 8000,
+        },
+        "output": {
+            "encoding": "mulaw",
+            "sample_rate": 8000,
+            "container": "none",
+        },
+    },
+    "agent": {
+        "language": "en",
+        "listen": {
+            "provider": {
+                "type": "deepgram",
+                "model": "nova-3",
+                "keyterms": ["emergency", "help", "police", "fire", "ambulance", "urgent"]
+            }
+        },
+        "think": {
+            "provider": {
+                "type": "open_ai",
+                "model": "gpt-4o-mini",
+                "temperature": 0.7
+            },
+            "prompt": """You are a helpful AI assistant for emergency dispatch during high-call-volume incidents. 
+                        
+                        Your role is to assist callers with non-emergency inquiries and provide guidance. You should:
+                        
+                        1. Be empathetic and professional
+                        2. Provide helpful information about the current incident if available
+                        3. Offer guidance on what callers should do
+                        4. Escalate to human operators if the situation becomes urgent
+                        5. Keep responses concise and clear
+                        
+                        If the caller mentions anything that sounds like an emergency (life-threatening situations, 
+                        active crimes, medical emergencies, fires, etc.), immediately advise them to hang up and 
+                        call 911 directly for immediate assistance.
+                        
+                        Focus on being helpful while maintaining safety as the top priority."""
+        },
+        "speak": {
+            "provider": {
+                "type": "deepgram",
+                "model": "aura-2-thalia-en"
+            }
+        },
+        "greeting": "Hello, how can I help with your emergency?"
+    }
+}
+
+# Encoded once; every session is configured with the same message. Control
+# messages go out as str because Deepgram and Twilio read binary frames as audio.
+_AGENT_SETTINGS_JSON = orjson.dumps(AGENT_SETTINGS).decode()
+
+# Seconds a prewarmed session waits for its Twilio stream before it is closed.
+# The stream may never arrive in this process (emergency, hangup, or another worker).
+PREWARM_TTL = 15
+
+# Sessions being opened ahead of the Twilio stream, keyed by CallSid
+_prewarmed: Dict[str, asyncio.Task] = {}
+# Strong references to close tasks for sessions nobody claimed
+_closing: set = set()
+
+def _discard(task: asyncio.Task):
+    """Cancel a prewarmed session that is still connecting, or close it if it's open"""
+    if not task.done():
+        task.cancel()
+    elif not task.cancelled() and task.exception() is None:
+        closer = asyncio.create_task(task.result().close())
+        _closing.add(closer)
+        closer.add_done_callback(_closing.discard)
+
+# Twilio media frames always start with the event name; the payload is base64,
+# so it can't contain a quote and ends at the next one
+_MEDIA_FRAME_PREFIX = '{"event":"media"'
+_PAYLOAD_KEY = '"payload":"'
+_INBOUND_TRACK = '"track":"inbound"'
+
+def _media_payload(message) -> Optional[str]:
+    """
+    Slice the audio payload out of a Twilio media frame without parsing the JSON
+    
+    Returns:
+        The base64 payload of an inbound frame, or None if the message isn't
+        one in the expected shape; those are left to the JSON parser, which
+        also handles frames from other tracks
+    """
+    if type(message) is not str or not message.startswith(_MEDIA_FRAME_PREFIX):
+        return None
+    start = message.find(_PAYLOAD_KEY)
+    if start == -1:
+        return None
+    start += len(_PAYLOAD_KEY)
+    end = message.find('"', start)
+    if end == -1:
+        return None
+    payload = message[start:end]
+    # An escaped character means the payload needs a real parse
+    if "\\" in payload:
+        return None
+    return payload if _INBOUND_TRACK in message else None
+
+def _expire(call_sid: str, task: asyncio.Task):
+    if _prewarmed.get(call_sid) is task:
+        del _prewarmed[call_sid]
+        _discard(task)
+
 class DeepgramVoiceAgent:
     """Voice agent that handles non-emergency calls using Deepgram's Voice Agent API"""
     
@@ -23,152 +143,184 @@ class DeepgramVoiceAgent:
     
     def _connect_to_deepgram(self):
         """Establish WebSocket connection to Deepgram's agent service"""
+        # mulaw audio doesn't compress, so per-message deflate would only cost CPU;
+        # the larger write buffer absorbs bursts of agent speech
         return websockets.connect(
-            "wss://agent.deepgram.com/v1/agent/converse",
-            subprotocols=["token", self.api_key]
+            DEEPGRAM_AGENT_URL,
+            subprotocols=["token", self.api_key],
+            compression=None,
+            max_size=None,
+            max_queue=64,
+            write_limit=2**20,
         )
     
+    async def _open_session(self):
+        """Connect to Deepgram and configure the agent"""
+        sts_ws = await self._connect_to_deepgram()
+        try:
+            await sts_ws.send(_AGENT_SETTINGS_JSON)
+        except BaseException:
+            await sts_ws.close()
+            raise
+        return sts_ws
+    
+    def prewarm(self, call_sid: str):
+        """
+        Start opening a Deepgram session for a call being handed to the agent
+        
+        The handshake and agent setup then overlap with Twilio connecting the
+        media stream; twilio_handler picks the session up when the stream starts.
+        
+        Args:
+            call_sid: Twilio CallSid the session is held for
+        """
+        if not call_sid or call_sid in _prewarmed:
+            return
+        task = asyncio.create_task(self._open_session())
+        _prewarmed[call_sid] = task
+        asyncio.get_running_loop().call_later(PREWARM_TTL, _expire, call_sid, task)
+    
+    async def _session_for(self, call_sid: str):
+        """Claim the call's prewarmed session, or open a new one"""
+        task = _prewarmed.pop(call_sid, None)
+        if task is not None:
+            try:
+                return await task
+            except Exception as e:
+                logger.warning("Prewarmed Deepgram session failed, reconnecting: %s", e)
+        return await self._open_session()
+    
     async def twilio_handler(self, twilio_ws):
         """Handle WebSocket connection from Twilio and manage voice agent conversation"""
-        audio_queue = asyncio.Queue()
-        streamsid_queue = asyncio.Queue()
+        # One producer and one consumer, so a deque plus a wakeup event is
+        # enough; no Queue locking or per-item future
+        audio_buf = deque()
+        audio_ready = asyncio.Event()
         
-        async with self._connect_to_deepgram() as sts_ws:
-            # Configure the voice agent for emergency dispatch context
-            config_message = {
-                "type": "Settings",
-                "audio": {
-                    "input": {
-                        "encoding": "mulaw",
-                        "sample_rate": 8000,
-                    },
-                    "output": {
-                        "encoding": "mulaw",
-                        "sample_rate": 8000,
-                        "container": "none",
-                    },
-                },
-                "agent": {
-                    "language": "en",
-                    "listen": {
-                        "provider": {
-                            "type": "deepgram",
-                            "model": "nova-3",
-                            "keyterms": ["emergency", "help", "police", "fire", "ambulance", "urgent"]
-                        }
-                    },
-                    "think": {
-                        "provider": {
-                            "type": "open_ai",
-                            "model": "gpt-4o-mini",
-                            "temperature": 0.7
-                        },
-                        "prompt": """You are a helpful AI assistant for emergency dispatch during high-call-volume incidents. 
-                        
-                        Your role is to assist callers with non-emergency inquiries and provide guidance. You should:
-                        
-                        1. Be empathetic and professional
-                        2. Provide helpful information about the current incident if available
-                        3. Offer guidance on what callers should do
-                        4. Escalate to human operators if the situation becomes urgent
-                        5. Keep responses concise and clear
-                        
-                        If the caller mentions anything that sounds like an emergency (life-threatening situations, 
-                        active crimes, medical emergencies, fires, etc.), immediately advise them to hang up and 
-                        call 911 directly for immediate assistance.
-                        
-                        Focus on being helpful while maintaining safety as the top priority."""
-                    },
-                    "speak": {
-                        "provider": {
-                            "type": "deepgram",
-                            "model": "aura-2-thalia-en"
-                        }
-                    },
-                    "greeting": "Hello, how can I help with your emergency?"
-                }
-            }
-            
-            await sts_ws.send(json.dumps(config_message))
-            
-            # Start async tasks
-            await asyncio.wait([
-                asyncio.ensure_future(self._sts_sender(sts_ws, audio_queue)),
-                asyncio.ensure_future(self._sts_receiver(sts_ws, twilio_ws, streamsid_queue)),
-                asyncio.ensure_future(self._twilio_receiver(twilio_ws, audio_queue, streamsid_queue)),
-            ])
+        # Twilio sends "connected" and then "start", which carries the CallSid
+        # needed to pick up a prewarmed session, before any audio
+        start = None
+        async for message in twilio_ws:
+            data = orjson.loads(message)
+            if data["event"] == "start":
+                start = data["start"]
+                break
+            if data["event"] == "stop":
+                break
+        if start is None:
+            return
+        logger.debug("✅ Got stream SID from Twilio")
+        streamsid = start["streamSid"]
+        
+        async with await self._session_for(start.get("callSid")) as sts_ws:
+            # The call is over as soon as either side stops (Twilio's stream
+            # ends or Deepgram closes); the rest are cancelled with it, and the
+            # TaskGroup cancels the siblings of any task that fails
+            async with asyncio.TaskGroup() as tg:
+                tasks = [
+                    tg.create_task(self._sts_sender(sts_ws, audio_buf, audio_ready)),
+                    tg.create_task(self._sts_receiver(sts_ws, twilio_ws, streamsid)),
+                    tg.create_task(self._twilio_receiver(twilio_ws, audio_buf, audio_ready)),
+                ]
+                await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in tasks:
+                    task.cancel()
             
-            await twilio_ws.close()
+            # After a normal hangup Twilio has already closed its side
+            if not twilio_ws.closed:
+                try:
+                    await twilio_ws.close()
+                except RuntimeError:  # disconnected while we were closing
+                    pass
     
-    async def _sts_sender(self, sts_ws, audio_queue):
+    async def _sts_sender(self, sts_ws, audio_buf, audio_ready):
         """Send audio from Twilio to Deepgram"""
-        print("🎤 Deepgram sender started")
-        while True:
-            chunk = await audio_queue.get()
-            await sts_ws.send(chunk)
+        logger.debug("🎤 Deepgram sender started")
+        send, next_chunk = sts_ws.send, audio_buf.popleft
+        try:
+            while True:
+                if not audio_buf:
+                    audio_ready.clear()
+                    await audio_ready.wait()
+                # Chunks that piled up while the last send was in flight go out as
+                # one frame; mulaw has no framing, so Deepgram can take any length
+                if len(audio_buf) > 1:
+                    chunks = list(audio_buf)
+                    audio_buf.clear()
+                    await send(b"".join(chunks))
+                else:
+                    await send(next_chunk())
+        except websockets.ConnectionClosed:
+            # Deepgram ended the session; the call is over
+            return
     
-    async def _sts_receiver(self, sts_ws, twilio_ws, streamsid_queue):
+    async def _sts_receiver(self, sts_ws, twilio_ws, streamsid):
         """Receive responses from Deepgram and send to Twilio"""
-        print("🎤 Deepgram receiver started")
-        # Wait for stream SID from Twilio
-        streamsid = await streamsid_queue.get()
+        logger.debug("🎤 Deepgram receiver started")
+        # The stream SID is fixed for the call, so both envelopes are built once;
+        # each audio frame only has its payload spliced in
+        clear_message = orjson.dumps({"event": "clear", "streamSid": streamsid}).decode()
+        media_prefix = '{"event":"media","streamSid":' + orjson.dumps(streamsid).decode() + ',"media":{"payload":"'
+        media_suffix = '"}}'
+        # Bound once; this runs for every audio frame Deepgram sends back
+        send = twilio_ws.send
         
-        async for message in sts_ws:
-            if type(message) is str:
-                print(f"Deepgram response: {message}")
+        try:
+            async for message in sts_ws:
+                # Audio is nearly every frame, so it's checked first; websockets
+                # hands binary frames over as bytes, never bytearray
+                if isinstance(message, bytes):
+                    # Send audio response to Twilio
+                    payload = binascii.b2a_base64(message, newline=False).decode("ascii")
+                    await send(media_prefix + payload + media_suffix)
+                    continue
+                
+                # Deepgram sends an event for every turn
+                logger.debug("Deepgram response: %s", message)
                 # Handle barge-in (user started speaking)
                 try:
-                    decoded = json.loads(message)
-                    if decoded.get('type') == 'UserStartedSpeaking':
-                        clear_message = {
-                            "event": "clear",
-                            "streamSid": streamsid
-                        }
-                        await twilio_ws.send(json.dumps(clear_message))
-                except:
-                    pass
-                continue
-            
-            # Send audio response to Twilio
-            if isinstance(message, bytes):
-                media_message = {
-                    "event": "media",
-                    "streamSid": streamsid,
-                    "media": {"payload": base64.b64encode(message).decode("ascii")},
-                }
-                await twilio_ws.send(json.dumps(media_message))
+                    decoded = orjson.loads(message)
+                    barge_in = decoded.get('type') == 'UserStartedSpeaking'
+                except (ValueError, AttributeError):
+                    continue
+                if barge_in:
+                    await send(clear_message)
+        except websockets.ConnectionClosed:
+            # Either side hung up (the Twilio wrapper raises the same error);
+            # the call is over
+            return
     
-    async def _twilio_receiver(self, twilio_ws, audio_queue, streamsid_queue):
+    async def _twilio_receiver(self, twilio_ws, audio_buf, audio_ready):
         """Receive audio from Twilio and buffer for Deepgram"""
-        print("🎤 Twilio receiver started")
+        logger.debug("🎤 Twilio receiver started")
         # Twilio sends 160-byte messages (20ms of audio each)
         # Buffer 20 messages (0.4 seconds) for better performance
         BUFFER_SIZE = 20 * 160
-        inbuffer = bytearray(b"")
+        inbuffer = bytearray()
         
         async for message in twilio_ws:
             try:
-                data = json.loads(message)
-                if data["event"] == "start":
-                    print("✅ Got stream SID from Twilio")
-                    start = data["start"]
-                    streamsid = start["streamSid"]
-                    streamsid_queue.put_nowait(streamsid)
-                elif data["event"] == "connected":
-                    continue
-                elif data["event"] == "media":
-                    media = data["media"]
-                    chunk = base64.b64decode(media["payload"])
-                    if media["track"] == "inbound":
-                        inbuffer.extend(chunk)
-                elif data["event"] == "stop":
-                    break
+                # Media frames are nearly all of the traffic, so they skip the parser
+                payload = _media_payload(message)
+                if payload is None:
+                    data = orjson.loads(message)
+                    # "connected" and "start" were already consumed by twilio_handler
+                    if data["event"] == "media":
+                        media = data["media"]
+                        if media["track"] == "inbound":
+                            payload = media["payload"]
+                    elif data["event"] == "stop":
+                        break
+                if payload:
+                    inbuffer.extend(binascii.a2b_base64(payload))
                 
-                # Send buffered audio to Deepgram
+                # Send buffered audio to Deepgram. Deleting from the front of a
+                # bytearray just advances its start, so the tail isn't copied,
+                # and slicing a view copies each chunk once instead of twice.
                 while len(inbuffer) >= BUFFER_SIZE:
-                    chunk = inbuffer[:BUFFER_SIZE]
-                    audio_queue.put_nowait(chunk)
-                    inbuffer = inbuffer[BUFFER_SIZE:]
+                    audio_buf.append(bytes(memoryview(inbuffer)[:BUFFER_SIZE]))
+                    audio_ready.set()
+                    del inbuffer[:BUFFER_SIZE]
             except Exception as e:
-                print(f"Error in twilio_receiver: {e}")
+                logger.error("Error in twilio_receiver: %s", e)
                 break
\ No newline at end of file